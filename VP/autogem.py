@@ -0,0 +1,68 @@
+import queue
+import sys
+import threading
+
+from karakterbygger import save_json
+
+AUTOSAVE_DELAY = 2000  # Milliseconds without changes before the character is saved
+AUTOSAVE_VERSIONS = 5  # Previous versions of the file kept as <file>.1 to <file>.5
+
+
+class AutoSaver:
+    """Saves the character to its file a short while after it last changed, on a background thread.
+
+    changed() is called on the Tk thread for every change; the changes of a busy spell are saved
+    together, once things have been quiet for `delay` ms. The data is taken on the Tk thread and
+    written by the thread through save_json, so the file is never left half written. Only the first
+    save of a session moves the earlier versions along, so a long session doesn't push out every
+    version from before it.
+    """
+
+    def __init__(self, widget, character, filename, delay=AUTOSAVE_DELAY, versions=AUTOSAVE_VERSIONS):
+        self.widget = widget
+        self.character = character
+        self.filename = filename
+        self.delay = delay
+        self.versions = versions
+        self.rotated = False  # Whether this session has kept a version of the file yet
+        self.timer = None
+        self.saves = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="autogem", daemon=True)
+        self.thread.start()
+
+    def changed(self):
+        if self.timer is not None:
+            self.widget.after_cancel(self.timer)
+        self.timer = self.widget.after(self.delay, self.save)
+
+    def save(self):
+        self.timer = None
+        self.saves.put(self.character.to_data())
+
+    def run(self):
+        while True:
+            data = self.saves.get()
+            stopping = data is None
+            # Only the latest of the saves that have piled up needs writing
+            while not self.saves.empty():
+                latest = self.saves.get()
+                if latest is None:
+                    stopping = True
+                else:
+                    data = latest
+            if data is not None:
+                try:
+                    save_json(self.filename, data, 0 if self.rotated else self.versions)
+                    self.rotated = True
+                except OSError as e:
+                    print(f"Autosave to {self.filename} failed: {e}", file=sys.stderr)
+            if stopping:
+                return
+
+    def stop(self):
+        """Save any change that is still waiting, and wait for the thread to finish writing."""
+        if self.timer is not None:
+            self.widget.after_cancel(self.timer)
+            self.save()
+        self.saves.put(None)
+        self.thread.join()
@@ -0,0 +1,76 @@
+import queue
+import threading
+
+from evneregler import RuleState
+
+POLL_INTERVAL = 10  # Milliseconds between looking for results from the worker thread
+
+
+class RuleJob:
+    """Working out the row states of an ability menu from `start` on, against a snapshot of the character.
+
+    deliver(job, start, states) is called on the Tk thread for every chunk of rows, and once more with
+    states None when the job is done. Setting cancelled stops the worker at the next chunk, and
+    whatever it had already worked out is dropped.
+    """
+
+    def __init__(self, matrix, snapshot, start, chunk, deliver):
+        self.matrix = matrix
+        self.snapshot = snapshot
+        self.start = start
+        self.chunk = chunk
+        self.deliver = deliver
+        self.cancelled = False
+
+
+class RuleWorker:
+    """Checks prerequisite rules on a background thread, so long menus don't hold up the Tk event loop.
+
+    The thread only reads the compiled rules and menu matrices of the catalog, which don't change
+    once loaded, and the immutable snapshot of each job. The catalog's bit index does grow when an id
+    outside the catalog gets a bit, but only on the Tk thread; the rules' masks were made when they
+    were compiled and the snapshot's when it was taken, so the thread never looks the index up. Its
+    results go through a queue that the Tk thread polls with after().
+    """
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.active = 0  # Jobs submitted that have not delivered their last chunk yet
+        self.polling = None
+        self.thread = threading.Thread(target=self.run, name="regler", daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        self.active += 1
+        self.jobs.put(job)
+        if self.polling is None:
+            self.polling = self.widget.after(POLL_INTERVAL, self.poll)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            position = job.start
+            if not job.cancelled:
+                rule_state = RuleState(job.snapshot)
+                while not job.cancelled and position < len(job.matrix.abilities):
+                    states = job.matrix.states(job.snapshot, rule_state, position, position + job.chunk)
+                    self.results.put((job, position, states))
+                    position += len(states)
+            self.results.put((job, position, None))
+
+    def poll(self):
+        """Hand the results that have come in to their jobs, on the Tk thread."""
+        self.polling = None
+        while True:
+            try:
+                job, start, states = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if states is None:
+                self.active -= 1
+            if not job.cancelled:
+                job.deliver(job, start, states)
+        if self.active:
+            self.polling = self.widget.after(POLL_INTERVAL, self.poll)
@@ -0,0 +1,250 @@
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from evnekatalog import MENU_UNLOCKS, AbilityCatalog
+from evneregler import RuleState
+from genafspilning import HeadlessAbilityManager
+from karakterbygger import Character
+
+try:
+    import karakterark
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+except ImportError:
+    # The character sheet benchmarks need reportlab; without it they are skipped
+    karakterark = None
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_SIZES = [1000, 10000, 100000]
+MENU_FILES = ["Filer/standardevner.json"] + sorted({file for _, file in MENU_UNLOCKS.values()})
+
+# The class menus and the flow that hands out their free abilities when the menu is first opened
+GRANT_FLOWS = [
+    ("Filer/alkymi.json", "grant_free_alchemist_abilities"),
+    ("Filer/præst.json", "grant_free_priest_abilities"),
+    ("Filer/paladin.json", "grant_free_paladin_abilities"),
+    ("Filer/kriger.json", "grant_free_warrior_abilities"),
+    ("Filer/druide.json", "grant_free_druid_abilities"),
+    ("Filer/heks.json", "grant_free_witch_abilities"),
+    ("Filer/runesmed.json", "grant_free_runesmith_abilities"),
+    ("Filer/trolddom.json", "grant_free_wizard_abilities"),
+]
+
+
+def _renamed(value, ids, suffix):
+    """A deep copy of value with every string that is one of ids given the suffix, dict keys included."""
+    if isinstance(value, str):
+        return value + suffix if value in ids else value
+    if isinstance(value, list):
+        return [_renamed(item, ids, suffix) for item in value]
+    if isinstance(value, dict):
+        return {_renamed(key, ids, suffix): _renamed(item, ids, suffix) for key, item in value.items()}
+    return value
+
+
+def write_scaled_catalog(directory, size, source="Filer"):
+    """Write the ability files of source to directory, repeated until there are at least `size` abilities.
+
+    Copy n > 0 of an ability has the id '<id>_x<n>', and so do its references to other abilities,
+    so every copy has its own prerequisite chains. The gods are not copied, since the god ids name
+    the schools the divine spells are checked against.
+    """
+    files = {}
+    for path in sorted(glob.glob(os.path.join(source, "*.json"))):
+        with open(path, 'r', encoding='utf-8') as file:
+            files[os.path.basename(path)] = json.load(file)
+    ids = {ability['id'] for abilities in files.values() for ability in abilities if ability.get('type') != 'god'}
+    total = sum(len(abilities) for abilities in files.values())
+    copies = max(1, -(-size // total))
+
+    os.makedirs(directory, exist_ok=True)
+    for name, abilities in files.items():
+        scaled = list(abilities)
+        for copy in range(1, copies):
+            scaled += [_renamed(ability, ids, f"_x{copy}") for ability in abilities if ability.get('type') != 'god']
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as file:
+            json.dump(scaled, file, ensure_ascii=False)
+
+
+def menu_gates():
+    """File name -> the ability that opens that class menu."""
+    return {os.path.basename(file): ability_id for ability_id, (_, file) in MENU_UNLOCKS.items()}
+
+
+def build_character(catalog, owned):
+    """A legal character that owns about `owned` abilities, bought a few at a time from every menu in turn."""
+    character = Character(catalog)
+    character.name = "Benchmark"
+    character.total_ep = 10 ** 6
+    gods = [ability_id for ability_id, ability in catalog.by_id.items() if ability.get('type') == 'god']
+    character.selected_god = gods[0] if gods else None
+    gates = menu_gates()
+
+    bought = True
+    while bought and len(character.abilities) < owned:
+        bought = False
+        for file in MENU_FILES:
+            gate = gates.get(os.path.basename(file))
+            if gate and not character.has_ability(gate):
+                continue
+            this_pass = 0
+            for ability in catalog.abilities(file):
+                if this_pass == 5 or len(character.abilities) >= owned:
+                    break
+                if ability.get('type') == 'god' or character.has_ability(ability['id']):
+                    continue
+                if catalog.rules[ability['id']](RuleState(character)):
+                    character.add_ability(ability['id'], ability['cost'])
+                    this_pass += 1
+                    bought = True
+    return character
+
+
+def measure(run, prepare=lambda: None, repeat=5):
+    """The fastest of `repeat` calls of run(prepare()), in seconds. prepare() is not timed."""
+    best = None
+    for _ in range(repeat):
+        argument = prepare()
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmarks(catalog, character_file):
+    """(name, run, prepare) for every hot path, run against the given catalog and saved character."""
+    character = Character(catalog)
+    character.load_from_file(character_file)
+
+    yield "load_from_file", lambda _: Character(catalog).load_from_file(character_file), lambda: None
+
+    for file in MENU_FILES:
+        name = os.path.basename(file)
+        manager = HeadlessAbilityManager(character, file, catalog=catalog)
+        yield f"update_ability_buttons/{name}", lambda _, manager=manager: manager.update_ability_buttons(), lambda: None
+
+    # The per-class check_*_prereqs methods are gone; every ability is checked by its compiled rule
+    for file in MENU_FILES:
+        name = os.path.basename(file)
+        abilities = catalog.abilities(file)
+        yield (f"regler/{name}",
+               lambda rule_state, abilities=abilities: [catalog.rules[ability['id']](rule_state) for ability in abilities],
+               lambda: RuleState(character))
+
+    # Each grant flow runs for a character with the same standard abilities that has just opened the class menu
+    gates = menu_gates()
+    standard = [ability_id for ability_id in character.abilities if catalog.source[ability_id] == "standardevner.json"]
+    for file, method in GRANT_FLOWS:
+        def fresh_manager(file=file):
+            fresh = Character(catalog)
+            fresh.selected_god = character.selected_god
+            fresh.abilities = dict.fromkeys(standard + [gates[os.path.basename(file)]])
+            return HeadlessAbilityManager(fresh, file, catalog=catalog)
+        yield method, lambda manager, method=method: getattr(manager, method)(), fresh_manager
+
+    if karakterark is not None:
+        character_data = {'name': character.name, 'race': character.race, 'abilities': character.abilities,
+                          'lp_max': character.lp_max}
+        index = karakterark.AbilityIndex(catalog, karakterark.CLASS_FILES)
+        yield ("process_class_abilities",
+               lambda _: karakterark.process_class_abilities(character_data, index, karakterark.calculate_stat_fn),
+               lambda: None)
+        general = karakterark.process_general_abilities(character_data, index)
+        classes = karakterark.process_class_abilities(character_data, index, karakterark.calculate_stat_fn)
+        yield ("add_abilities_to_pdf",
+               lambda c: karakterark.add_abilities_to_pdf(c, general, classes, 750),
+               lambda: canvas.Canvas(io.BytesIO(), pagesize=A4))
+
+
+def run_benchmarks(sizes, owned, repeat):
+    """Name -> fastest time in seconds, for every benchmark at every catalog size."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            catalog_directory = os.path.join(directory, str(size))
+            write_scaled_catalog(catalog_directory, size)
+            start = time.perf_counter()
+            catalog = AbilityCatalog(catalog_directory)
+            results[f"{size}/AbilityCatalog"] = time.perf_counter() - start
+            print(f"{size}: {len(catalog)} abilities", file=sys.stderr)
+
+            character_file = os.path.join(directory, f"karakter_{size}.json")
+            build_character(catalog, owned).save_to_file(character_file)
+
+            for name, run, prepare in benchmarks(catalog, character_file):
+                try:
+                    results[f"{size}/{name}"] = measure(run, prepare, repeat)
+                except Exception as error:
+                    print(f"{size}/{name} failed: {error!r}", file=sys.stderr)
+    return results
+
+
+def calibrate(repeat=5):
+    """Time a fixed piece of plain Python work, to tell how fast this machine is right now."""
+    return measure(lambda _: sorted(str(number) for number in range(200000)), repeat=repeat)
+
+
+def compare(results, baseline, tolerance, speed=1.0, noise=0.0005):
+    """The names of the benchmarks that got slower than the baseline by more than tolerance (and noise).
+
+    speed is how much slower this machine is than the one the baseline was made on; the baseline
+    times are scaled by it before comparing.
+    """
+    return [name for name, seconds in results.items()
+            if name in baseline and seconds > baseline[name] * speed * (1 + tolerance) + noise]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tag tid på karakterbyggeren og karakterarket, uden skærm.")
+    parser.add_argument("--skala", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="antal evner i de opskalerede kataloger (standard: 1000 10000 100000)")
+    parser.add_argument("--evner", type=int, default=300, help="antal evner testkarakteren ejer (standard: 300)")
+    parser.add_argument("--gentag", type=int, default=5, help="antal gentagelser, den hurtigste tæller (standard: 5)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"baselinefil (standard: {BASELINE_FILE})")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="hvor meget langsommere end baseline før det er en regression (standard: 0.25)")
+    parser.add_argument("--gem", action="store_true", help="gem resultaterne som ny baseline")
+    args = parser.parse_args(argv)
+
+    calibration = calibrate(args.gentag)
+    results = run_benchmarks(args.skala, args.evner, args.gentag)
+
+    baseline, speed = {}, 1.0
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            saved = json.load(file)
+        baseline, speed = saved['results'], calibration / saved['calibration']
+        print(f"This machine is {speed:.2f} times as slow as the one the baseline was made on")
+    regressions = compare(results, baseline, args.tolerance, speed)
+
+    for name, seconds in results.items():
+        line = f"{name:60} {seconds * 1000:10.2f} ms"
+        if name in baseline:
+            expected = baseline[name] * speed
+            line += f"  (baseline {expected * 1000:.2f} ms, {seconds / expected - 1:+.0%})"
+        if name in regressions:
+            line += "  REGRESSION"
+        print(line)
+
+    if args.gem:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump({"machine": {"python": platform.python_version(), "platform": platform.platform(),
+                                   "processor": platform.processor()},
+                       "calibration": calibration, "results": results}, file, indent=4, ensure_ascii=False)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    print(f"{len(regressions)} regressions against {args.baseline}" if baseline else "No baseline to compare against")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
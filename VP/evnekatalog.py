@@ -0,0 +1,230 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import unicodedata
+
+from evnematrix import AvailabilityMatrix
+from evneregler import aggregate_keys, compile_rules, normalize_prerequisites
+from tidsmaaling import timed, timed_function
+
+
+# Bump when the compiled catalog structures change, so old snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+# Abilities that open a class menu when bought: ability id -> (menu button text, ability file)
+MENU_UNLOCKS = {
+    "ability_alkymi": ("Alkymievner", "Filer/alkymi.json"),
+    "ability_guddommelig_vassal": ("Paladinevner", "Filer/paladin.json"),
+    "ability_hellig_ed": ("Præsteevner", "Filer/præst.json"),
+    "ability_kaste_skrive_magi": ("Trolddomsevner", "Filer/trolddom.json"),
+    "ability_shamanisme": ("Shamanevner", "Filer/shaman.json"),
+    "ability_skyggepagt": ("Hekseevner", "Filer/heks.json"),
+    "ability_vogter_af_naturens_sjael": ("Druideevner", "Filer/druide.json"),
+    "ability_kamptraening": ("Krigerevner", "Filer/kriger.json"),
+    "ability_runesmedning": ("Runesmedevner", "Filer/runesmed.json")
+}
+
+
+def _file_key(filename):
+    """Turn 'Filer/præst.json' (or just 'præst.json') into the catalog key 'præst.json'."""
+    # macOS hands out decomposed file names, so normalize before comparing with the literals in the code
+    return unicodedata.normalize('NFC', os.path.basename(filename))
+
+
+class AbilityList(list):
+    """The abilities of one file, in file order, with an id index attached."""
+
+    def __init__(self, abilities):
+        super().__init__(abilities)
+        self.by_id = {}
+        self.positions = {}  # ability id -> indices in the file
+        for position, ability in enumerate(self):
+            # Keep the first entry if an id is repeated inside a file
+            self.by_id.setdefault(ability['id'], ability)
+            self.positions.setdefault(ability['id'], []).append(position)
+
+
+class AbilityCatalog:
+    """Every ability file in Filer/, parsed once and indexed by id."""
+
+    def __init__(self, directory="Filer"):
+        self.directory = directory
+        self.files = {}    # file name -> AbilityList
+        self.by_id = {}    # ability id -> ability (first file wins for shared ids such as the gods)
+        self.source = {}   # ability id -> file name
+        self.prerequisites = {}  # ability id -> normalized Prerequisite
+        self.rules = {}    # ability id -> compiled prerequisite rule
+        self.dependents = {}  # ability id or aggregate key -> ids of abilities whose prerequisites use it
+        self.bit_indices = {}  # ability id -> bit of the ability in owned-ability masks
+        self.matrices = {}  # file name -> AvailabilityMatrix, built when a menu first needs it
+        self.load()
+
+    def load(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+            self.add_file(path)
+
+    def add_file(self, path):
+        with timed("catalog/parse_json"), open(path, 'r', encoding='utf-8') as file:
+            abilities = AbilityList(json.load(file))
+        key = _file_key(path)
+        self.files[key] = abilities
+        for ability_id, ability in abilities.by_id.items():
+            if ability_id not in self.by_id:
+                self.by_id[ability_id] = ability
+                self.source[ability_id] = key
+            self.bit_index(ability_id)
+        with timed("catalog/compile_rules"):
+            prerequisites = normalize_prerequisites(abilities, key)
+            rules = compile_rules(prerequisites, self)
+        for ability_id, rule in rules.items():
+            self.prerequisites.setdefault(ability_id, prerequisites[ability_id])
+            self.rules.setdefault(ability_id, rule)
+            for signal in rule.signals:
+                self.dependents.setdefault(signal, set()).add(ability_id)
+        return abilities
+
+    def abilities(self, filename):
+        """Return the abilities of a single file, e.g. 'Filer/paladin.json'."""
+        abilities = self.files.get(_file_key(filename))
+        if abilities is None:
+            # Not one of the files in Filer/, so read it once and keep it
+            abilities = self.add_file(filename)
+        return abilities
+
+    def matrix(self, filename):
+        """The batched availability check for the abilities of one file."""
+        abilities = self.abilities(filename)
+        key = _file_key(filename)
+        if key not in self.matrices:
+            with timed("catalog/build_matrix"):
+                self.matrices[key] = AvailabilityMatrix(abilities, self)
+        return self.matrices[key]
+
+    def affected_by(self, ability_ids):
+        """Ids of the abilities whose prerequisites may change when these abilities are bought or removed."""
+        affected = set()
+        for ability_id in ability_ids:
+            affected.add(ability_id)
+            affected.update(self.dependents.get(ability_id, ()))
+            ability = self.by_id.get(ability_id)
+            if ability is not None:
+                for key in aggregate_keys(ability):
+                    affected.update(self.dependents.get(key, ()))
+        return affected
+
+    def bit_index(self, ability_id):
+        """The bit of an ability in owned-ability masks. Ids outside the catalog get the next free bit."""
+        index = self.bit_indices.get(ability_id)
+        if index is None:
+            index = self.bit_indices[ability_id] = len(self.bit_indices)
+        return index
+
+    def mask(self, ability_ids):
+        """Pack a collection of ability ids into an integer with one bit per ability."""
+        mask = 0
+        for ability_id in ability_ids:
+            mask |= 1 << self.bit_index(ability_id)
+        return mask
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The matrices depend on whether NumPy is installed, so they are rebuilt on use
+        state['matrices'] = {}
+        return state
+
+    def get(self, ability_id, default=None):
+        return self.by_id.get(ability_id, default)
+
+    def __contains__(self, ability_id):
+        return ability_id in self.by_id
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+def snapshot_path(directory="Filer"):
+    """The compiled snapshot of a directory is stored next to it, e.g. Filer/ -> Filer.snapshot."""
+    return os.path.abspath(directory).rstrip(os.sep) + ".snapshot"
+
+
+@timed_function("catalog/source_stamps")
+def source_stamps(directory="Filer"):
+    """The modification time and content hash of every JSON file a snapshot was built from."""
+    stamps = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        stamps[_file_key(path)] = (os.stat(path).st_mtime_ns, digest)
+    return stamps
+
+
+@timed_function("catalog/read_snapshot")
+def read_snapshot(directory="Filer", stamps=None):
+    """Return the catalog stored in the snapshot, or None if there is none or the JSON files changed since."""
+    stamps = stamps if stamps is not None else source_stamps(directory)
+    try:
+        with open(snapshot_path(directory), 'rb') as file:
+            if pickle.load(file) != (SNAPSHOT_VERSION, stamps):
+                return None
+            return pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def write_snapshot(catalog, stamps=None):
+    """Store a compiled catalog next to its directory.
+
+    Returns False if the snapshot couldn't be written; the catalog then just loads without one.
+    """
+    stamps = stamps if stamps is not None else source_stamps(catalog.directory)
+    path = snapshot_path(catalog.directory)
+    # Batch workers may build the snapshot at the same time, so each writes its own file and swaps it in
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            pickle.dump((SNAPSHOT_VERSION, stamps), file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(catalog, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        return True
+    # Something in the catalog that can't be pickled shows up as any of the last three
+    except (OSError, pickle.PicklingError, AttributeError, TypeError):
+        return False
+    finally:
+        # Only left behind if the write or the swap failed
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+@timed_function("catalog/load")
+def load_catalog(directory="Filer"):
+    """Load the catalog from its snapshot, compiling the JSON files (and saving a new snapshot) if it is stale."""
+    stamps = source_stamps(directory)
+    catalog = read_snapshot(directory, stamps)
+    if catalog is None:
+        catalog = AbilityCatalog(directory)
+        write_snapshot(catalog, stamps)
+    return catalog
+
+
+_catalogs = {}
+
+
+def get_catalog(directory="Filer"):
+    """Return the shared catalog for a directory, loading it on first use."""
+    key = os.path.abspath(directory)
+    if key not in _catalogs:
+        _catalogs[key] = load_catalog(directory)
+    return _catalogs[key]
+
+
+if __name__ == "__main__":
+    # Build step: compile Filer/ into Filer.snapshot ahead of time
+    catalog = AbilityCatalog()
+    if write_snapshot(catalog):
+        print(f"Wrote {snapshot_path()} with {len(catalog)} abilities")
+    else:
+        print(f"Could not write {snapshot_path()}")
@@ -0,0 +1,102 @@
+from bisect import bisect_left
+from collections import namedtuple
+
+from evneregler import AllOf, OwnsAll, RuleState
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional; without it every ability's rule is called on its own
+    numpy = None
+
+
+# Per ability of a file, in file order: owned already, prerequisites met, and cost within the remaining EP
+Availability = namedtuple('Availability', ['owned', 'eligible', 'affordable'])
+
+
+def _split(rule):
+    """Split a rule into the ids it plainly requires and the rules that are left to call one by one."""
+    if isinstance(rule, OwnsAll):
+        return rule.ids, ()
+    if isinstance(rule, AllOf):
+        required = frozenset().union(*(part.ids for part in rule.rules if isinstance(part, OwnsAll)))
+        return required, tuple(part for part in rule.rules if not isinstance(part, OwnsAll))
+    return frozenset(), (rule,)
+
+
+class AvailabilityMatrix:
+    """Checks every ability of one file against a character in a single batched pass.
+
+    The plain "requires these abilities" part of the rules is kept as a sparse boolean matrix of
+    abilities x required ids (stored as row/column pairs), tested against the character's ownership
+    vector in one go. Only what is left over (god choices, grade counts and so on) is called per ability.
+    Both can be asked for a slice of the file, so a long menu can be worked out a piece at a time.
+    """
+
+    def __init__(self, abilities, catalog):
+        self.abilities = abilities
+        self.catalog = catalog
+        self.columns = {}  # ability id -> index in the ownership vector
+        rows, columns = [], []
+        self.leftovers = []  # (position, rules) still to call for abilities whose requirements are met
+        for position, ability in enumerate(abilities):
+            required, rest = _split(catalog.rules[ability['id']])
+            for ability_id in required:
+                rows.append(position)
+                columns.append(self.columns.setdefault(ability_id, len(self.columns)))
+            if rest:
+                self.leftovers.append((position, rest))
+        self.leftover_positions = [position for position, _ in self.leftovers]
+        own_columns = [self.columns.setdefault(ability['id'], len(self.columns)) for ability in abilities]
+        costs = [ability['cost'] for ability in abilities]
+
+        if numpy is not None:
+            self.rows = numpy.array(rows, dtype=numpy.intp)
+            self.required_columns = numpy.array(columns, dtype=numpy.intp)
+            self.own_columns = numpy.array(own_columns, dtype=numpy.intp)
+            self.costs = numpy.array(costs)
+        else:
+            self.costs = costs
+
+    def evaluate(self, character, rule_state=None, start=0, stop=None):
+        """Work out which abilities of the file (from start up to stop) the character owns, may buy and can afford."""
+        rule_state = rule_state or RuleState(character)
+        stop = len(self.abilities) if stop is None else min(stop, len(self.abilities))
+        if numpy is None:
+            abilities = self.abilities[start:stop]
+            owned = [character.has_ability(ability['id']) for ability in abilities]
+            eligible = [self.catalog.rules[ability['id']](rule_state) for ability in abilities]
+            remaining = character.remaining_ep()
+            return Availability(owned, eligible, [cost <= remaining for cost in self.costs[start:stop]])
+
+        ownership = numpy.zeros(len(self.columns), dtype=bool)
+        ownership[[self.columns[ability_id] for ability_id in character.abilities if ability_id in self.columns]] = True
+        # Count the required ids each ability is missing; an ability is eligible when none are.
+        # The rows are in file order, so the slice's requirements are a slice of them too
+        first, last = numpy.searchsorted(self.rows, [start, stop])
+        missing = numpy.bincount(self.rows[first:last] - start, weights=~ownership[self.required_columns[first:last]],
+                                 minlength=stop - start)
+        eligible = missing == 0
+        for index in range(bisect_left(self.leftover_positions, start), bisect_left(self.leftover_positions, stop)):
+            position, rules = self.leftovers[index]
+            if eligible[position - start]:
+                eligible[position - start] = all(rule(rule_state) for rule in rules)
+        return Availability(ownership[self.own_columns[start:stop]], eligible,
+                            self.costs[start:stop] <= character.remaining_ep())
+
+    def states(self, character, rule_state=None, start=0, stop=None):
+        """Row states for the ability menu, as AbilityManager.ability_state would give them one by one.
+
+        With start and stop, only the states of that slice of the file are worked out and returned.
+        """
+        owned, eligible, affordable = self.evaluate(character, rule_state, start, stop)
+        states = [
+            "bought" if is_owned else "available" if is_eligible else None
+            for is_owned, is_eligible in zip(owned, eligible)
+        ]
+        # The chosen god is listed, but greyed out like a bought ability
+        for position in self.abilities.positions.get(character.selected_god, ()):
+            if start <= position < start + len(states) and states[position - start] == "available" \
+                    and self.abilities[position].get('type') == 'god':
+                states[position - start] = "bought"
+        return states
@@ -0,0 +1,467 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from graphlib import CycleError, TopologicalSorter
+from itertools import combinations, product
+from math import comb
+
+from evnekatalog import MENU_UNLOCKS, get_catalog
+from evneregler import AllOf, AnyOf, OwnsAll, OwnsAny, PlanState, RuleState, aggregate_keys
+
+# Abilities that can stand in for each other: same cost, prerequisites, counters and menu, and no
+# rule names any of them. Only how many of them are owned matters, not which ones.
+AbilityGroup = namedtuple('AbilityGroup', ['ids', 'cost', 'gate'])
+
+# A block sees the abilities of other blocks only through checks like these: owns all, or any, of some ids
+Condition = namedtuple('Condition', ['kind', 'ids'])
+
+# One distinct legal build: the abilities bought on top of the starting ones, the chosen god and the EP spent
+Build = namedtuple('Build', ['abilities', 'selected_god', 'cost'])
+
+# The number of distinct legal builds, in total and by the EP they spend (by_cost[ep])
+BuildCount = namedtuple('BuildCount', ['total', 'by_cost'])
+
+# Stands in the block order for the point where a god may be chosen
+GOD_CHOICE = 'god'
+
+
+def _reads(rule):
+    """What a rule looks at: a Condition for each plain owns-all/owns-any check, the raw signal for everything else."""
+    if isinstance(rule, (AllOf, AnyOf)):
+        for part in rule.rules:
+            yield from _reads(part)
+    elif isinstance(rule, OwnsAll):
+        yield Condition('all', rule.ids)
+    elif isinstance(rule, OwnsAny):
+        yield Condition('any', rule.ids)
+    else:
+        yield from rule.signals
+
+
+class Block:
+    """Groups whose rules read each other through counters or god checks, so they must be searched together."""
+
+    def __init__(self, groups, conditions, reads_god):
+        self.groups = sorted(groups, key=lambda group: group.cost)
+        self.conditions = conditions  # Conditions on abilities outside the block
+        self.reads_god = reads_god
+        self.ids = frozenset(ability_id for group in groups for ability_id in group.ids)
+
+
+class BuildSpace:
+    """Every distinct legal build a character can reach within an EP budget.
+
+    A build is the set of abilities bought, plus the god chosen; the purchase order doesn't matter.
+    Trying every purchase order explodes long before a starting budget is used up, so the search
+    is cut down in three ways:
+
+    - Abilities that can stand in for each other are grouped (AbilityGroup), and a state only
+      records how many of each group are owned. One state stands for every choice of members.
+    - The abilities are split into blocks that only see each other through plain "requires" checks
+      (and the god). Each block is searched on its own, once per distinct answer to its checks.
+    - The blocks are combined one at a time, merging partial builds that look the same to every
+      block still to come (same god, same answers to their checks) into one EP histogram. The
+      blocks are put in an order that keeps the number of open checks, and so of merged states, low.
+
+    Costs and rules are those AbilityManager applies, including the menu each ability is bought
+    from. Free abilities handed out when a class menu is first opened are not counted.
+    """
+
+    def __init__(self, catalog, start, budget):
+        self.catalog = catalog
+        self.start = start
+        self.budget = budget
+        gates = {os.path.basename(file): ability_id for ability_id, (_, file) in MENU_UNLOCKS.items()}
+        self.gods = [ability_id for ability_id, ability in catalog.by_id.items() if ability.get('type') == 'god']
+
+        buyable = {ability_id: ability for ability_id, ability in catalog.by_id.items()
+                   if ability.get('type') != 'god' and not start.has_ability(ability_id)}
+        reads = {ability_id: list(_reads(catalog.rules[ability_id])) for ability_id in buyable}
+        named = set(gates.values())
+        for signals in reads.values():
+            for signal in signals:
+                if isinstance(signal, Condition):
+                    named.update(signal.ids)
+                elif isinstance(signal, str):
+                    named.add(signal)
+
+        keyed = {}
+        for ability_id, ability in buyable.items():
+            gate = gates.get(catalog.source[ability_id])
+            prerequisite = catalog.prerequisites[ability_id]
+            if ability_id in named or prerequisite.kind in ("god", "second_school"):
+                key = ability_id
+            else:
+                key = (ability['cost'], prerequisite, tuple(aggregate_keys(ability)), gate)
+            keyed.setdefault(key, []).append(ability_id)
+        self.groups = [AbilityGroup(tuple(ids), buyable[ids[0]]['cost'], gates.get(catalog.source[ids[0]]))
+                       for ids in keyed.values()]
+        self.group_of = {ability_id: index for index, group in enumerate(self.groups) for ability_id in group.ids}
+
+        # Gods are chosen in the menus they are listed in
+        god_files = {file for file, abilities in catalog.files.items() if any(god in abilities.by_id for god in self.gods)}
+        self.god_condition = self._external(Condition('any', frozenset(gates[file] for file in god_files if file in gates)), ())
+
+        graph = self._build_blocks(reads)
+        self.interface = frozenset(ability_id for node in graph for condition in self._checks(node)
+                                   for ability_id in condition.ids)
+        self.order = self._order_blocks(graph)
+        self._plan_steps()
+        self._histograms = {}
+        self._states = {}
+
+    @classmethod
+    def from_character_data(cls, catalog, character_data, total_ep=None):
+        """The builds of a character as stored in its JSON file, with its own total EP unless another is given."""
+        if total_ep is None:
+            total_ep = character_data.get('total_ep', 0)
+        return cls(catalog, PlanState.from_character_data(catalog, character_data),
+                   total_ep - character_data.get('spent_ep', 0))
+
+    def _external(self, condition, block_ids):
+        """The part of a condition that depends on abilities outside a block, or None if it is settled already."""
+        ids = frozenset(ability_id for ability_id in condition.ids if ability_id not in block_ids)
+        if condition.kind == 'any':
+            if not ids or any(self.start.has_ability(ability_id) for ability_id in ids):
+                # Decided inside the block, or met by the starting abilities
+                return None
+            return Condition('any', ids)
+        ids = frozenset(ability_id for ability_id in ids if not self.start.has_ability(ability_id))
+        return Condition('all', ids) if ids else None
+
+    def _build_blocks(self, reads):
+        """Split the groups into blocks, and return which blocks (or the god choice) each one checks."""
+        parent = list(range(len(self.groups)))
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        def union(first, second):
+            parent[find(first)] = find(second)
+
+        by_key = {}
+        for index, group in enumerate(self.groups):
+            for key in aggregate_keys(self.catalog.by_id[group.ids[0]]):
+                by_key.setdefault(key, []).append(index)
+        for index, group in enumerate(self.groups):
+            for signal in reads[group.ids[0]]:
+                if isinstance(signal, tuple) and not isinstance(signal, Condition):
+                    # Counters are shared by everything counted under them
+                    for other in by_key.get(signal, ()):
+                        union(index, other)
+                elif isinstance(signal, str) and signal in self.group_of:
+                    # Any other use of an id than a plain requirement (e.g. the second wizard school)
+                    union(index, self.group_of[signal])
+
+        while True:
+            members = {}
+            for index in range(len(self.groups)):
+                members.setdefault(find(index), []).append(index)
+            self.blocks = [self._make_block(indices, reads) for indices in members.values()]
+            block_of = {ability_id: position for position, block in enumerate(self.blocks) for ability_id in block.ids}
+            graph = {GOD_CHOICE: set()}
+            for node in [GOD_CHOICE] + list(range(len(self.blocks))):
+                graph[node] = {block_of[ability_id] for condition in self._checks(node)
+                               for ability_id in condition.ids if ability_id in block_of}
+                if node != GOD_CHOICE and self.blocks[node].reads_god:
+                    graph[node].add(GOD_CHOICE)
+            try:
+                TopologicalSorter(graph).prepare()
+                return graph
+            except CycleError as error:
+                cycle = error.args[1]
+                if GOD_CHOICE in cycle:
+                    raise ValueError("The god choice depends on abilities that depend on the god") from error
+                # Blocks that check each other can't be searched one after the other, so join them
+                first = self.group_of[self.blocks[cycle[0]].groups[0].ids[0]]
+                for position in cycle[1:]:
+                    union(first, self.group_of[self.blocks[position].groups[0].ids[0]])
+
+    def _make_block(self, indices, reads):
+        groups = [self.groups[index] for index in indices]
+        block_ids = frozenset(ability_id for group in groups for ability_id in group.ids)
+        conditions, reads_god = {}, False
+        for group in groups:
+            checks = [signal for signal in reads[group.ids[0]] if isinstance(signal, Condition)]
+            if group.gate:
+                checks.append(Condition('all', frozenset([group.gate])))
+            for check in checks:
+                condition = self._external(check, block_ids)
+                if condition is not None:
+                    conditions.setdefault(condition, None)
+            reads_god = reads_god or 'selected_god' in self.catalog.rules[group.ids[0]].signals
+        return Block(groups, list(conditions), reads_god)
+
+    def _checks(self, node):
+        if node == GOD_CHOICE:
+            return [self.god_condition] if self.god_condition else []
+        return self.blocks[node].conditions
+
+    def _order_blocks(self, graph):
+        """A dependency order for the blocks that keeps few checks open at a time.
+
+        A check is open from when the first block it looks at is searched until the last block
+        making it is, and every open check can double the number of partial builds kept apart.
+        Of the blocks that are ready, the one opening the fewest (and closing the most) checks goes next.
+        """
+        readers = {}
+        for node in graph:
+            for condition in self._checks(node):
+                readers.setdefault(condition, set()).add(node)
+        opens = {node: [condition for condition in readers if not self.blocks[node].ids.isdisjoint(condition.ids)]
+                 for node in graph if node != GOD_CHOICE}
+        god_readers = {node for node, dependencies in graph.items() if GOD_CHOICE in dependencies}
+        # The god counts as a check with many answers
+        god_weight = len(self.gods).bit_length()
+        rank = {node: index for index, node in enumerate(graph)}
+        done, opened, order = set(), set(), []
+
+        def growth(node):
+            change = sum(1 for condition in opens.get(node, ())
+                         if condition not in opened and readers[condition] - done - {node})
+            change -= sum(1 for condition in self._checks(node)
+                          if condition in opened and readers[condition] - done == {node})
+            if node == GOD_CHOICE and god_readers:
+                change += god_weight
+            elif node in god_readers and god_readers - done == {node}:
+                change -= god_weight
+            return change, rank[node]
+
+        while len(order) < len(graph):
+            node = min((node for node in graph if node not in done and graph[node] <= done), key=growth)
+            order.append(node)
+            done.add(node)
+            opened.update(opens.get(node, ()))
+        return order
+
+    def _plan_steps(self):
+        """Work out, for each step of the order, what later steps can still tell apart."""
+        self._settled = []   # interface ids whose ownership is final after the step
+        self._watched = []   # checks of later steps whose answer may already differ between partial builds
+        self._god_kept = []  # whether a later step still looks at the god
+        settled = self.interface - self.group_of.keys()
+        for step, node in enumerate(self.order):
+            if node != GOD_CHOICE:
+                settled |= self.blocks[node].ids & self.interface
+            later = self.order[step + 1:]
+            conditions = dict.fromkeys(condition for later_node in later for condition in self._checks(later_node))
+            self._settled.append(frozenset(settled))
+            self._watched.append([condition for condition in conditions if not settled.isdisjoint(condition.ids)])
+            self._god_kept.append(any(later_node == GOD_CHOICE or self.blocks[later_node].reads_god
+                                      for later_node in later))
+
+    @staticmethod
+    def _answers(conditions, owned, settled=None):
+        """The answer to each check for a set of owned ids; with settled, 'all' only looks at the settled ids."""
+        return tuple(not condition.ids.isdisjoint(owned) if condition.kind == 'any'
+                     else (condition.ids if settled is None else condition.ids & settled) <= owned
+                     for condition in conditions)
+
+    def _god_available(self, external):
+        return self.god_condition is None or self._answers([self.god_condition], external)[0]
+
+    def block_states(self, position, god, external):
+        """Yield (counts, cost) for every legal state of a block, given the god and the owned ids outside it.
+
+        counts holds the number of owned abilities per group of the block, in block.groups order.
+        """
+        groups = self.blocks[position].groups
+        start = PlanState(self.catalog, self.start.abilities | external, god, self.start.lp_max)
+        empty = (0,) * len(groups)
+        seen = {empty}
+        pending = [(empty, 0, start)]
+        while pending:
+            counts, cost, state = pending.pop()
+            yield counts, cost
+            rule_state = RuleState(state)
+            remaining = self.budget - cost
+            for index, group in enumerate(groups):
+                if group.cost > remaining:
+                    # The groups are sorted by cost, so nothing further on is affordable either
+                    break
+                owned = counts[index]
+                if owned == len(group.ids) or (group.gate and not state.has_ability(group.gate)):
+                    continue
+                ability_id = group.ids[owned]
+                if not self.catalog.rules[ability_id](rule_state):
+                    continue
+                successor = counts[:index] + (owned + 1,) + counts[index + 1:]
+                if successor not in seen:
+                    seen.add(successor)
+                    pending.append((successor, cost + group.cost, state.after(ability_id)))
+
+    def _produced(self, block, counts):
+        """The ids of a block state that other blocks check for."""
+        return frozenset(ability_id for group, owned in zip(block.groups, counts)
+                         for ability_id in group.ids[:owned] if ability_id in self.interface)
+
+    def block_histograms(self, position, god, external):
+        """Ids other blocks check for -> number of builds of one block by EP spent."""
+        block = self.blocks[position]
+        histograms = {}
+        for counts, cost in self.block_states(position, god, external):
+            weight = 1
+            for group, owned in zip(block.groups, counts):
+                weight *= comb(len(group.ids), owned)
+            histogram = histograms.setdefault(self._produced(block, counts), [0] * (self.budget + 1))
+            histogram[cost] += weight
+        return histograms
+
+    def _block_key(self, position, god, external):
+        block = self.blocks[position]
+        return position, god if block.reads_god else None, self._answers(block.conditions, external)
+
+    def count(self, workers=1):
+        """Count the distinct legal builds, searching the blocks over a pool of processes if workers > 1."""
+        if self.budget < 0:
+            return BuildCount(0, [])
+        pool = None
+        if workers is None or workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(self.catalog.directory, self.start.abilities,
+                                                 self.start.selected_god, self.start.lp_max, self.budget))
+        try:
+            # Partial builds that look the same to every later block: (god, answers) -> [EP histogram, owned ids]
+            frontier = {(self.start.selected_god, ()): [[1] + [0] * self.budget, frozenset()]}
+            for step in range(len(self.order)):
+                frontier = self._advance(frontier, step, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        by_cost = _add([histogram for histogram, _ in frontier.values()])
+        return BuildCount(sum(by_cost), by_cost)
+
+    def _advance(self, frontier, step, pool):
+        """Add the block at one step of the order to every partial build."""
+        node = self.order[step]
+        if node == GOD_CHOICE:
+            extended = []
+            for (god, _), (histogram, external) in frontier.items():
+                extended.append((god, external, histogram))
+                if god is None and self._god_available(external):
+                    extended += [(choice, external, histogram) for choice in self.gods]
+        else:
+            tasks = {}
+            for (god, _), (_, external) in frontier.items():
+                key = self._block_key(node, god, external)
+                if key not in self._histograms:
+                    tasks.setdefault(key, (node, key[1], external))
+            if pool is not None and len(tasks) > 1:
+                for key, histograms in zip(tasks, pool.map(_block_histograms_in_worker, tasks.values())):
+                    self._histograms[key] = histograms
+            else:
+                for key, arguments in tasks.items():
+                    self._histograms[key] = self.block_histograms(*arguments)
+            extended = [(god, external | produced, _convolve(histogram, block_histogram))
+                        for (god, _), (histogram, external) in frontier.items()
+                        for produced, block_histogram in self._histograms[self._block_key(node, god, external)].items()]
+
+        watched, settled, god_kept = self._watched[step], self._settled[step], self._god_kept[step]
+        watched_ids = frozenset().union(*(condition.ids for condition in watched))
+        advanced = {}
+        for god, external, histogram in extended:
+            key = (god if god_kept else None, self._answers(watched, external, settled))
+            if key in advanced:
+                advanced[key][0] = _add([advanced[key][0], histogram])
+            else:
+                # Any of the merged builds can stand in for the rest, as the later blocks can't tell them apart
+                advanced[key] = [histogram, external & watched_ids]
+        return advanced
+
+    def builds(self):
+        """Yield every distinct legal build, one at a time. There are usually far too many to keep in a list."""
+        if self.budget >= 0:
+            yield from self._builds(0, self.start.selected_god, frozenset(), (), 0)
+
+    def _builds(self, step, god, external, bought, cost):
+        if step == len(self.order):
+            yield Build(frozenset(bought), god, cost)
+            return
+        node = self.order[step]
+        if node == GOD_CHOICE:
+            yield from self._builds(step + 1, god, external, bought, cost)
+            if god is None and self._god_available(external):
+                for choice in self.gods:
+                    yield from self._builds(step + 1, choice, external, bought, cost)
+            return
+
+        block = self.blocks[node]
+        key = self._block_key(node, god, external)
+        if key not in self._states:
+            self._states[key] = list(self.block_states(node, key[1], external))
+        for counts, block_cost in self._states[key]:
+            if cost + block_cost > self.budget:
+                continue
+            produced = self._produced(block, counts)
+            choices = [combinations(group.ids, owned) for group, owned in zip(block.groups, counts) if owned]
+            for chosen in product(*choices):
+                ids = tuple(ability_id for members in chosen for ability_id in members)
+                yield from self._builds(step + 1, god, external | produced, bought + ids, cost + block_cost)
+
+
+def _add(histograms):
+    return [sum(counts) for counts in zip(*histograms)]
+
+
+def _convolve(first, second):
+    """Builds of two independent parts, by total EP, cut off at the budget."""
+    result = [0] * len(first)
+    terms = [(cost, count) for cost, count in enumerate(second) if count]
+    for first_cost, first_count in enumerate(first):
+        if first_count:
+            for second_cost, second_count in terms:
+                if first_cost + second_cost >= len(result):
+                    break
+                result[first_cost + second_cost] += first_count * second_count
+    return result
+
+
+_worker_space = None
+
+
+def _init_worker(directory, abilities, selected_god, lp_max, budget):
+    global _worker_space
+    catalog = get_catalog(directory)
+    _worker_space = BuildSpace(catalog, PlanState(catalog, abilities, selected_god, lp_max), budget)
+
+
+def _block_histograms_in_worker(arguments):
+    return _worker_space.block_histograms(*arguments)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tæl (eller list) alle lovlige evnesæt en karakter kan nå for sine EP.")
+    parser.add_argument("karakter", help="karakterfil (.json), f.eks. 'Nye karakterer/Menneske_Vestlener.json'")
+    parser.add_argument("--ep", type=int, help="samlet EP (standard: karakterens total_ep)")
+    parser.add_argument("--list", action="store_true", help="skriv hvert evnesæt som en linje JSON i stedet for at tælle")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="antal processer (standard: én pr. kerne)")
+    args = parser.parse_args(argv)
+
+    with open(args.karakter, 'r', encoding='utf-8') as file:
+        character_data = json.load(file)
+    space = BuildSpace.from_character_data(get_catalog(), character_data, args.ep)
+
+    if args.list:
+        for build in space.builds():
+            print(json.dumps({"abilities": sorted(build.abilities), "selected_god": build.selected_god,
+                              "cost": build.cost}, ensure_ascii=False))
+        return 0
+
+    result = space.count(args.jobs)
+    for ep, count in enumerate(result.by_cost):
+        if count:
+            print(f"{ep} EP: {count}")
+    print(f"I alt: {result.total} evnesæt")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,570 @@
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+
+from evnekatalog import MENU_UNLOCKS, get_catalog
+from evneregler import PlanState, RuleState, aggregate_keys
+
+# The purchases in order (a god is chosen rather than bought, and costs no EP), and their total EP
+Plan = namedtuple('Plan', ['steps', 'total_ep'])
+
+
+class Planner:
+    """Finds the cheapest legal purchase order that gets a character to a target ability.
+
+    A quick first plan comes from working through the normalized prerequisites as an AND/OR tree:
+    every requirement is met in turn, and for alternatives (any-of groups, counts, god choices) the
+    cheapest option on its own is taken. The cheapest way to get an ability is remembered per state
+    of the abilities that can matter for it, so shared sub-chains are only worked out once.
+
+    Choices settled one at a time can miss purchases that serve several requirements at once, so the
+    first plan is then only the bound for a branch and bound over every choice (see _search), which
+    finds the cheapest plan. Class abilities also need the ability that opens their menu. Every plan
+    is replayed against the compiled rules before it is returned. Free abilities handed out when a
+    class menu is first opened are not counted.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.by_key = {}  # aggregate key -> ids counted under it, cheapest first
+        for ability_id, ability in catalog.by_id.items():
+            for key in aggregate_keys(ability):
+                self.by_key.setdefault(key, []).append(ability_id)
+        for ids in self.by_key.values():
+            ids.sort(key=self.cost)
+        self.gods = [ability_id for ability_id, ability in catalog.by_id.items() if ability.get('type') == 'god']
+        self.menu_unlocks = {os.path.basename(file): ability_id for ability_id, (_, file) in MENU_UNLOCKS.items()}
+        self.twins = self._find_twins()
+        self._cones = {}
+        self._cheapest = {}  # (ability id, relevant owned ids, god, LP) -> (cost, steps)
+        self._groups_cache = {}  # (prerequisite, god) -> groups of alternatives the search branches on
+
+    def _find_twins(self):
+        """Ability id -> every ability interchangeable with it, in a fixed order, for those that have any.
+
+        Abilities are interchangeable when they cost the same, count under the same aggregates, have
+        the same prerequisite and menu, and no prerequisite names them.
+        """
+        named, pending = set(), list(self.catalog.prerequisites.values())
+        while pending:
+            prerequisite = pending.pop()
+            named.update(prerequisite.ids)
+            for group in prerequisite.any_ids:
+                named.update(group)
+            if prerequisite.kind == "second_school":
+                for schools in prerequisite.params:
+                    named.update(schools)
+            pending += prerequisite.all_of + prerequisite.any_of
+        classes = {}
+        for ability_id, ability in self.catalog.by_id.items():
+            if ability_id not in named and ability.get('type') != 'god':
+                key = (self.cost(ability_id), tuple(aggregate_keys(ability)), self.catalog.prerequisites[ability_id],
+                       self.menu_unlock(ability_id))
+                classes.setdefault(key, []).append(ability_id)
+        return {ability_id: ids for ids in map(sorted, classes.values()) if len(ids) > 1 for ability_id in ids}
+
+    def cost(self, ability_id):
+        ability = self.catalog.by_id[ability_id]
+        return 0 if ability.get('type') == 'god' else ability['cost']
+
+    def menu_unlock(self, ability_id):
+        """The ability that opens the menu an ability is bought from, if any. Gods are chosen in any divine menu."""
+        if self.catalog.by_id[ability_id].get('type') == 'god':
+            return None
+        return self.menu_unlocks.get(self.catalog.source[ability_id])
+
+    def cone(self, ability_id):
+        """Every ability that can affect whether, and how cheaply, this ability can be bought."""
+        cone = self._cones.get(ability_id)
+        if cone is None:
+            cone, pending = set(), [ability_id]
+            while pending:
+                current = pending.pop()
+                if current in cone or current not in self.catalog:
+                    continue
+                cone.add(current)
+                if self.menu_unlock(current):
+                    pending.append(self.menu_unlock(current))
+                for signal in self.catalog.rules[current].signals:
+                    if isinstance(signal, tuple):
+                        pending.extend(self.by_key.get(signal, ()))
+                    elif signal in self.catalog:
+                        pending.append(signal)
+            cone = self._cones[ability_id] = frozenset(cone)
+        return cone
+
+    def plan(self, state, target_id):
+        """The plan to reach target_id from state, or None if no legal build gets there."""
+        if target_id not in self.catalog:
+            raise ValueError(f"Unknown ability: {target_id}")
+        result = self._acquire(target_id, state, frozenset())
+        if result is None:
+            return None
+        bound, steps, _ = result
+        total_ep, steps = self._search(state, target_id, bound, steps)
+        self._check(state, steps)
+        return Plan(list(steps), total_ep)
+
+    def _groups(self, prerequisite, selected_god):
+        """The requirements of a prerequisite the search branches on, as (alternatives, how many) pairs.
+
+        An alternative is an ability id or a nested prerequisite. Requirements that don't fit this
+        (LP, no more than some number, a second wizard school) are left to the rules when the
+        purchases are put in order.
+        """
+        key = (prerequisite, selected_god)
+        groups = self._groups_cache.get(key)
+        if groups is None:
+            groups = self._groups_cache[key] = self._find_groups(prerequisite, selected_god)
+        return groups
+
+    def _find_groups(self, prerequisite, selected_god):
+        kind = prerequisite.kind
+        if kind in ("never", "god", "second_school"):
+            return []
+        groups = []
+        if kind in ("codex", "divine") and selected_god is None:
+            school = prerequisite.params[1] if kind == "divine" else None
+            groups.append(((f"god_{school}",) if school not in (None, 'almen') else tuple(self.gods), 1))
+        if kind == "divine":
+            spell_type, _, almen, god_school = prerequisite.params
+            if almen:
+                groups.append((self._spells_from(spell_type, ['almen'], almen), 1))
+            if god_school:
+                if selected_god is not None:
+                    schools = [selected_god.replace("god_", "")]
+                else:
+                    schools = [god_id.replace("god_", "") for god_id in self.gods]
+                groups.append((self._spells_from(spell_type, schools, god_school), 1))
+        if kind == "recipe":
+            grade, required = prerequisite.params
+            if required:
+                groups.append((tuple(self.by_key.get(('type_grade', None, grade - 1), ())), required))
+        groups += [((ability_id,), 1) for ability_id in prerequisite.ids]
+        groups += [(group, 1) for group in prerequisite.any_ids]
+        groups += [(tuple(self.by_key.get(key, ())), count) for key, count in prerequisite.counts if count > 0]
+        for nested in prerequisite.all_of:
+            groups += self._find_groups(nested, selected_god)
+        if prerequisite.any_of:
+            groups.append((prerequisite.any_of, 1))
+        return groups
+
+    def _spells_from(self, spell_type, schools, grade):
+        return tuple(ability_id for school in schools for ability_id in self.by_key.get(('type_school', spell_type, school), ())
+                     if self.catalog.by_id[ability_id].get('grade', 0) >= grade)
+
+    def _met(self, alternative, have, god):
+        """Whether an alternative is met by the abilities (and god) in `have`."""
+        if isinstance(alternative, str):
+            return alternative in have
+        return not any(self._lacking(group, count, have, god) for group, count in self._groups(alternative, god))
+
+    def _lacking(self, group, count, have, god, needed=None, ability_id=None):
+        """How many more alternatives of a group have to be met. Those that need ability_id itself can't count for it."""
+        for option in group:
+            if self._met(option, have, god) and (needed is None or ability_id not in needed.get(option, ())):
+                count -= 1
+        return max(count, 0)
+
+    def _requirements(self, ability_id, have, god):
+        """The groups ability_id needs, with its menu and the third-grade school a second wizard school needs.
+
+        None if it can't be bought next to the abilities in `have` at all.
+        """
+        groups = list(self._groups(self.catalog.prerequisites[ability_id], god))
+        unlock = self.menu_unlock(ability_id)
+        if unlock:
+            groups.append(((unlock,), 1))
+        prerequisite = self.catalog.prerequisites[ability_id]
+        if prerequisite.kind == "second_school":
+            first_grades, third_grades = prerequisite.params
+            others = [school for school in first_grades if school in have and school != ability_id]
+            if len(others) > 1:
+                return None
+            if others:
+                groups.append((third_grades, 1))
+        if prerequisite.kind == "recipe" and prerequisite.params[0] > 1:
+            # There may not be more recipes of a grade than of the grade below
+            grade = prerequisite.params[0]
+            same = sum(1 for other in self.by_key.get(('type_grade', None, grade), ()) if other in have and other != ability_id)
+            groups.append((tuple(self.by_key.get(('type_grade', None, grade - 1), ())), same + 1))
+        return groups
+
+    def needed(self, target_id, state):
+        """For every ability in the target's cone, the abilities every build of it from state has to buy.
+
+        An ability needs itself and what its requirements need. Of a group of alternatives, only what
+        every alternative needs is needed. Prerequisite loops are settled by repeating this until
+        nothing more is found.
+        """
+        have = self._have(state.abilities, state.selected_god)
+        needed = {ability_id: frozenset() if ability_id in have else frozenset([ability_id])
+                  for ability_id in self.cone(target_id)}
+        changed = True
+        while changed:
+            changed = False
+            for ability_id, before in needed.items():
+                if not before:
+                    continue
+                after = set(before)
+                for group, count in self._requirements(ability_id, have, state.selected_god) or ():
+                    options = self._open(group, count, have, state.selected_god, needed, ability_id)
+                    if options and options[0]:
+                        after |= frozenset.intersection(*(needed.get(option, frozenset()) for option in options[0]))
+                if len(after) > len(before):
+                    needed[ability_id] = frozenset(after)
+                    changed = True
+        return needed
+
+    @staticmethod
+    def _have(abilities, god):
+        return abilities | {god} if god else abilities
+
+    def _open(self, group, count, have, god, needed, ability_id):
+        """(abilities that could go toward an unmet group next, how many more it takes), or None if the group is met.
+
+        A nested prerequisite is opened up into the alternatives of its first unmet group. An
+        ability that itself needs ability_id can't be bought before it, so it doesn't count.
+        """
+        still = self._lacking(group, count, have, god, needed, ability_id)
+        if not still:
+            return None
+        options = []
+        for option in group:
+            if isinstance(option, str):
+                if option not in have and ability_id not in needed.get(option, ()):
+                    options.append(option)
+                continue
+            for nested_group, nested_count in self._groups(option, god):
+                nested = self._open(nested_group, nested_count, have, god, needed, ability_id)
+                if nested is not None:
+                    options += nested[0]
+                    break
+        return list(dict.fromkeys(options)), still
+
+    def _search(self, state, target_id, bound, bound_steps):
+        """(cost, steps) of the cheapest plan, or of the plan for `bound` if none is cheaper.
+
+        The search starts from what the target needs and puts as much of it in order as the rules
+        allow. The abilities left over each lack some group of their requirements, and any plan for
+        the target buys one more alternative from one of those groups, so every such alternative is
+        tried in turn, with what it needs. Abilities that serve several requirements are only paid
+        for once. A choice is given up once its EP, plus what its unmet groups will take at least,
+        reaches the cheapest plan found so far.
+        """
+        needed = self.needed(target_id, state)
+        best = [bound, tuple(bound_steps)]
+        self._branch(needed[target_id] | {target_id}, state, needed, best, frozenset())
+        return best[0], best[1]
+
+    def _branch(self, chosen, state, needed, best, passed):
+        cost = sum(self.cost(ability_id) for ability_id in chosen)
+        if cost >= best[0]:
+            return
+        steps, stuck = self._order(chosen, state)
+        if not stuck:
+            best[:] = [cost, steps]
+            return
+
+        god = state.selected_god or next((ability_id for ability_id in chosen if ability_id in self.gods), None)
+        have = self._have(state.abilities | frozenset(steps), god if god in steps else state.selected_god)
+        unmet = {}
+        for ability_id in stuck:
+            requirements = self._requirements(ability_id, have, god)
+            if requirements is None:
+                return
+            unmet[ability_id] = []
+            for group, count in requirements:
+                options = self._open(group, count, have, god, needed, ability_id)
+                if options is None:
+                    continue
+                options, still = [option for option in options[0] if option not in passed], options[1]
+                if len(options) < still:
+                    return
+                unmet[ability_id].append((options, still))
+
+        def extra(option):
+            if option in chosen:
+                return 0
+            return sum(self.cost(other) for other in needed.get(option, frozenset()) | {option} if other not in chosen)
+
+        def serves(option, ability_id):
+            """(EP it takes at least before option can go toward ability_id, the abilities that may be), or None."""
+            if option not in chosen:
+                return extra(option) and self.cost(option), {option}
+            at_least, stands_for = 0, {option}
+            for options, still in unmet.get(option, ()):
+                usable = [other for other in options if other != ability_id and ability_id not in needed.get(other, ())]
+                if sum(other in chosen for other in usable) >= still:
+                    continue
+                # A chosen ability that is stuck itself only counts once one of its own alternatives comes in
+                costs = [self.cost(other) for other in usable if other not in chosen]
+                if not costs:
+                    return None
+                at_least = max(at_least, min(costs))
+                stands_for.update(options)
+            return at_least, stands_for
+
+        # Every unmet group takes at least its cheapest alternatives, and groups with nothing in
+        # common take different ones
+        floors = []
+        for ability_id, groups in unmet.items():
+            for options, still in groups:
+                served = [pair for pair in (serves(option, ability_id) for option in options) if pair is not None]
+                if len(served) < still:
+                    return
+                floors.append((sum(sorted(at_least for at_least, _ in served)[:still]),
+                               set().union(*(stands_for for _, stands_for in served))))
+        floor, counted = 0, set()
+        for group_floor, stands_for in sorted(floors, key=lambda pair: (-pair[0], len(pair[1]))):
+            if counted.isdisjoint(stands_for):
+                floor += group_floor
+                counted.update(stands_for)
+        # The chosen abilities are stuck as they are, so at least one new one has to come in
+        fresh = [extra(option) for groups in unmet.values() for options, _ in groups for option in options
+                 if option not in chosen]
+        if not fresh:
+            return
+        floor = max(floor, min(fresh))
+        if cost + floor >= best[0]:
+            return
+        choices = set()
+        for options, _ in (group for groups in unmet.values() for group in groups):
+            for option in options:
+                if option in self.twins:
+                    # Which of a set of twins is bought makes no difference, so only the next one is tried
+                    option = next((twin for twin in self.twins[option] if twin not in chosen and not state.has_ability(twin)),
+                                  option)
+                if option not in chosen and option not in passed:
+                    choices.add(option)
+        # Each choice leaves out the ones tried before it, so no set of abilities is reached twice
+        passed = set(passed)
+        for option in sorted(choices, key=lambda option: (extra(option), option)):
+            following = chosen | needed.get(option, frozenset()) | {option}
+            if passed.isdisjoint(following):
+                self._branch(following, state, needed, best, frozenset(passed))
+            passed.add(option)
+
+    def _order(self, chosen, state):
+        """(the chosen abilities the rules allow buying, in order, the ones left over)."""
+        pending = sorted(chosen - state.abilities, key=lambda ability_id: (self.cost(ability_id), ability_id))
+        steps = []
+        while pending:
+            for ability_id in pending:
+                unlock = self.menu_unlock(ability_id)
+                if (not unlock or state.has_ability(unlock)) and self.catalog.rules[ability_id](RuleState(state)):
+                    break
+            else:
+                break
+            pending.remove(ability_id)
+            steps.append(ability_id)
+            state = state.after(ability_id)
+        return tuple(steps), pending
+
+    def _check(self, state, steps):
+        for ability_id in steps:
+            unlock = self.menu_unlock(ability_id)
+            if unlock and not state.has_ability(unlock):
+                raise RuntimeError(f"Planned purchase of {ability_id} comes before its menu is opened")
+            if not self.catalog.rules[ability_id](RuleState(state)):
+                raise RuntimeError(f"Planned purchase of {ability_id} is not allowed at that point")
+            state = state.after(ability_id)
+
+    def _acquire(self, ability_id, state, path):
+        """(cost, steps, state after) for getting one ability, or None if it can't be had."""
+        if state.has_ability(ability_id) or state.selected_god == ability_id:
+            return 0, (), state
+        if ability_id not in self.catalog or ability_id in path:
+            return None
+
+        key = (ability_id, state.abilities & self.cone(ability_id), state.selected_god, state.lp_max)
+        cached = self._cheapest.get(key)
+        if cached is not None:
+            cost, steps = cached
+            for step in steps:
+                state = state.after(step)
+            return cost, steps, state
+
+        path = path | {ability_id}
+        cost, steps = 0, ()
+        unlock = self.menu_unlock(ability_id)
+        if unlock:
+            result = self._acquire(unlock, state, path)
+            if result is None:
+                return None
+            cost, steps, state = result
+        result = self._satisfy(self.catalog.prerequisites[ability_id], ability_id, state, path)
+        if result is None:
+            return None
+        cost, steps, state = cost + result[0], steps + result[1], result[2]
+        cost, steps, state = cost + self.cost(ability_id), steps + (ability_id,), state.after(ability_id)
+        self._cheapest[key] = (cost, steps)
+        return cost, steps, state
+
+    def _cheapest_of(self, ability_ids, state, path):
+        best = None
+        for ability_id in sorted(ability_ids, key=self.cost):
+            if best is not None and self.cost(ability_id) >= best[0]:
+                # Getting an ability costs at least its own EP, so nothing further down can be cheaper
+                break
+            result = self._acquire(ability_id, state, path)
+            if result is not None and (best is None or result[0] < best[0]):
+                best = result
+        return best
+
+    def _reach_count(self, key, count, state, path):
+        """Buy the cheapest abilities under an aggregate key until the character owns `count` of them."""
+        cost, steps = 0, ()
+        while state.counters.counts[key] < count:
+            candidates = [ability_id for ability_id in self.by_key.get(key, ()) if not state.has_ability(ability_id)]
+            result = self._cheapest_of(candidates, state, path)
+            if result is None:
+                return None
+            cost, steps, state = cost + result[0], steps + result[1], result[2]
+        return cost, steps, state
+
+    def _reach_grade(self, spell_type, school, grade, state, path):
+        """Own a spell of at least `grade` in a school."""
+        if state.counters.max_grade(spell_type, school) >= grade:
+            return 0, (), state
+        candidates = {}
+        for ability_id in self.by_key.get(('type_school', spell_type, school), ()):
+            candidate_grade = self.catalog.by_id[ability_id].get('grade', 0)
+            if candidate_grade >= grade:
+                candidates.setdefault(candidate_grade, []).append(ability_id)
+        # Higher grades build on the lower ones, so only look further up if the grade itself is out of reach
+        for candidate_grade in sorted(candidates):
+            result = self._cheapest_of(candidates[candidate_grade], state, path)
+            if result is not None:
+                return result
+        return None
+
+    def _satisfy(self, prerequisite, ability_id, state, path):
+        """(cost, steps, state after) for meeting a prerequisite, or None if it can't be met."""
+        kind = prerequisite.kind
+        if kind == "never":
+            return None
+        if kind == "god":
+            return (0, (), state) if state.selected_god is None else None
+
+        if kind in ("codex", "divine"):
+            # Everything else in the divine menus waits for a god; pick the one that makes this cheapest
+            school = prerequisite.params[1] if kind == "divine" else None
+            gods = [f"god_{school}"] if school not in (None, 'almen') else self.gods
+            if state.selected_god is None:
+                best = None
+                for god_id in gods:
+                    if god_id not in self.catalog:
+                        continue
+                    result = self._satisfy(prerequisite, ability_id, state.after(god_id), path)
+                    if result is not None and (best is None or result[0] < best[0]):
+                        best = (result[0], (god_id,) + result[1], result[2])
+                return best
+            if state.selected_god not in gods:
+                return None
+
+        cost, steps = 0, ()
+
+        def add(result):
+            nonlocal cost, steps, state
+            if result is None:
+                return False
+            cost, steps, state = cost + result[0], steps + result[1], result[2]
+            return True
+
+        if kind == "codex" and state.counters.counts[('type', 'codex')] >= 1:
+            return None
+        if kind == "divine":
+            spell_type, school, almen, god_school = prerequisite.params
+            if almen and not add(self._reach_grade(spell_type, 'almen', almen, state, path)):
+                return None
+            god_school_name = state.selected_god.replace("god_", "")
+            if god_school and not add(self._reach_grade(spell_type, god_school_name, god_school, state, path)):
+                return None
+        if kind == "recipe":
+            grade, required = prerequisite.params
+            if grade > 1:
+                # There may not be more recipes of a grade than of the grade below
+                required = max(required, state.counters.counts[('type_grade', None, grade)] + 1)
+            if not add(self._reach_count(('type_grade', None, grade - 1), required, state, path)):
+                return None
+        if kind == "second_school":
+            first_grades, third_grades = prerequisite.params
+            owned = [school for school in first_grades if state.has_ability(school)]
+            if len(owned) > 1:
+                return None
+            if owned and not any(state.has_ability(school) for school in third_grades):
+                if not add(self._cheapest_of(third_grades, state, path)):
+                    return None
+
+        if state.lp_max < prerequisite.lp_max:
+            # LP maximum can't be bought
+            return None
+        for required in prerequisite.ids:
+            if not add(self._acquire(required, state, path)):
+                return None
+        for group in prerequisite.any_ids:
+            if not any(state.has_ability(option) for option in group):
+                if not add(self._cheapest_of(group, state, path)):
+                    return None
+        for key, count in prerequisite.counts:
+            if not add(self._reach_count(key, count, state, path)):
+                return None
+        for nested in prerequisite.all_of:
+            if not add(self._satisfy(nested, ability_id, state, path)):
+                return None
+        if prerequisite.any_of:
+            best = None
+            for nested in prerequisite.any_of:
+                result = self._satisfy(nested, ability_id, state, path)
+                if result is not None and (best is None or result[0] < best[0]):
+                    best = result
+            if not add(best):
+                return None
+        return cost, steps, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find den billigste vej fra en karakter til en evne.")
+    parser.add_argument("karakter", help="karakterfil (.json), f.eks. 'Nye karakterer/Menneske_Vestlener.json'")
+    parser.add_argument("evne", help="id på den evne karakteren skal have, f.eks. warrior_ability_level_3_tactics")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.karakter, 'r', encoding='utf-8') as file:
+            character_data = json.load(file)
+    except FileNotFoundError:
+        print(f"Karakterfilen {args.karakter} findes ikke")
+        return 1
+    except OSError:
+        print(f"Kan ikke læse {args.karakter}")
+        return 1
+    except ValueError:
+        print(f"{args.karakter} er ikke en gyldig karakterfil")
+        return 1
+    catalog = get_catalog()
+    if args.evne not in catalog.by_id:
+        print(f"Ukendt evne: {args.evne}")
+        return 1
+    try:
+        plan = Planner(catalog).plan(PlanState.from_character_data(catalog, character_data), args.evne)
+    except RuntimeError:
+        print(f"Den fundne plan til {args.evne} holder ikke efter reglerne")
+        return 1
+    if plan is None:
+        print(f"{args.evne} kan ikke nås fra {args.karakter}")
+        return 1
+
+    for ability_id in plan.steps:
+        ability = catalog.by_id[ability_id]
+        cost = "vælg gud" if ability.get('type') == 'god' else f"{ability['cost']} EP"
+        print(f"{ability['name']} ({ability_id}) - {cost}")
+    remaining_ep = character_data.get('total_ep', 0) - character_data.get('spent_ep', 0)
+    print(f"I alt: {plan.total_ep} EP (resterende EP: {remaining_ep})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
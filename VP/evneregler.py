@@ -0,0 +1,542 @@
+from collections import Counter, namedtuple
+
+# Prerequisite keys that require every listed ability
+ALL_KEYS = ('requires_ability', 'requires_abilities', 'required_ability', 'requires_spell')
+
+# Prerequisite keys that require at least one of the listed abilities
+ANY_KEYS = ('requires_one_of', 'requires_any_ability')
+
+
+def aggregate_keys(ability):
+    """The counters an owned ability adds to: its type, and its type per grade and per school."""
+    prereqs = ability.get('prerequisite')
+    ability_type = ability.get('type')
+    grade = ability.get('grade')
+    if grade is None and isinstance(prereqs, dict):
+        # Alchemy recipes only carry their grade in the prerequisite
+        grade = prereqs.get('grade')
+    keys = [('type', ability_type)]
+    if grade is not None:
+        keys.append(('type_grade', ability_type, grade))
+    if 'school' in ability:
+        keys.append(('type_school', ability_type, ability['school']))
+    return keys
+
+
+class AbilityCounters:
+    """Running aggregates over a character's abilities, kept up to date as abilities are added and removed.
+
+    counts holds the number of owned abilities per aggregate key (see aggregate_keys), and
+    school_grades the number of owned abilities per grade for every (type, school).
+    """
+
+    def __init__(self, catalog, ability_ids=()):
+        self.catalog = catalog
+        self.counts = Counter()
+        self.school_grades = {}  # (type, school) -> Counter of grade -> owned abilities
+        for ability_id in ability_ids:
+            self.add(ability_id)
+
+    def add(self, ability_id):
+        self._update(ability_id, 1)
+
+    def remove(self, ability_id):
+        self._update(ability_id, -1)
+
+    def _update(self, ability_id, step):
+        ability = self.catalog.get(ability_id)
+        if ability is None:
+            return
+        for key in aggregate_keys(ability):
+            self._step(self.counts, key, step)
+        if 'school' in ability:
+            grades = self.school_grades.setdefault((ability.get('type'), ability['school']), Counter())
+            self._step(grades, ability.get('grade', 0), step)
+
+    @staticmethod
+    def _step(counter, key, step):
+        counter[key] += step
+        if counter[key] <= 0:
+            del counter[key]
+
+    def max_grade(self, ability_type, school):
+        """The highest grade owned in a school, or 0 if none."""
+        return max(self.school_grades.get((ability_type, school), ()), default=0)
+
+    def copy(self):
+        counters = AbilityCounters(self.catalog)
+        counters.counts = self.counts.copy()
+        counters.school_grades = {key: grades.copy() for key, grades in self.school_grades.items()}
+        return counters
+
+
+class RuleState:
+    """What the rules look at for one character: the owned-ability mask, chosen god, LP and the aggregates."""
+
+    def __init__(self, character):
+        self.owned = character.ability_mask
+        self.selected_god = character.selected_god
+        self.god_school = character.selected_god.replace("god_", "") if character.selected_god else None
+        self.lp_max = character.lp_max
+        self.counts = character.counters.counts
+        self.max_grade = character.counters.max_grade
+
+
+class PlanState:
+    """An immutable character state, for the planner and for checking rules away from the Character.
+
+    It has the attributes RuleState reads from a Character, so the compiled rules can check it.
+    """
+
+    def __init__(self, catalog, abilities=(), selected_god=None, lp_max=0, counters=None):
+        self.catalog = catalog
+        self.abilities = frozenset(abilities)
+        self.ability_mask = catalog.mask(self.abilities)
+        self.selected_god = selected_god
+        self.lp_max = lp_max
+        self.counters = counters if counters is not None else AbilityCounters(catalog, self.abilities)
+
+    @classmethod
+    def from_character_data(cls, catalog, character_data):
+        """State of a character as stored in its JSON file."""
+        return cls(catalog, character_data.get('abilities', []), character_data.get('selected_god'),
+                   character_data.get('lp_max', 0))
+
+    def has_ability(self, ability_id):
+        return ability_id in self.abilities
+
+    def after(self, ability_id):
+        """The state after buying an ability, or choosing it if it is a god."""
+        if self.catalog.by_id[ability_id].get('type') == 'god':
+            return PlanState(self.catalog, self.abilities, ability_id, self.lp_max, self.counters)
+        counters = self.counters.copy()
+        counters.add(ability_id)
+        return PlanState(self.catalog, self.abilities | {ability_id}, self.selected_god, self.lp_max, counters)
+
+
+# The rules below are compiled once per ability when the catalog loads. Each one is called with a
+# RuleState and knows the signals (ability ids and aggregate keys) it reads, for the dependency index.
+
+class Always:
+    __slots__ = ('value', 'signals')
+
+    def __init__(self, value):
+        self.value = value
+        self.signals = frozenset()
+
+    def __call__(self, state):
+        return self.value
+
+
+class OwnsAll:
+    __slots__ = ('ids', 'mask', 'signals')
+
+    def __init__(self, ids, catalog):
+        self.ids = frozenset(ids)
+        self.mask = catalog.mask(self.ids)
+        self.signals = self.ids
+
+    def __call__(self, state):
+        return state.owned & self.mask == self.mask
+
+
+class OwnsAny:
+    __slots__ = ('ids', 'mask', 'signals')
+
+    def __init__(self, ids, catalog):
+        self.ids = frozenset(ids)
+        self.mask = catalog.mask(self.ids)
+        self.signals = self.ids
+
+    def __call__(self, state):
+        return state.owned & self.mask != 0
+
+
+class AllOf:
+    __slots__ = ('rules', 'signals')
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.signals = frozenset().union(*(rule.signals for rule in self.rules))
+
+    def __call__(self, state):
+        for rule in self.rules:
+            if not rule(state):
+                return False
+        return True
+
+
+class AnyOf:
+    __slots__ = ('rules', 'signals')
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.signals = frozenset().union(*(rule.signals for rule in self.rules))
+
+    def __call__(self, state):
+        for rule in self.rules:
+            if rule(state):
+                return True
+        return False
+
+
+class LpMaxAtLeast:
+    __slots__ = ('lp_max', 'signals')
+
+    def __init__(self, lp_max):
+        self.lp_max = lp_max
+        self.signals = frozenset(['lp_max'])
+
+    def __call__(self, state):
+        return state.lp_max >= self.lp_max
+
+
+class CountAtLeast:
+    """At least `count` owned abilities under an aggregate key, e.g. ('type_grade', 'druid_spell', 2)."""
+    __slots__ = ('key', 'count', 'signals')
+
+    def __init__(self, key, count):
+        self.key = key
+        self.count = count
+        self.signals = frozenset([key])
+
+    def __call__(self, state):
+        return state.counts[self.key] >= self.count
+
+
+class CountBelow:
+    __slots__ = ('key', 'count', 'signals')
+
+    def __init__(self, key, count):
+        self.key = key
+        self.count = count
+        self.signals = frozenset([key])
+
+    def __call__(self, state):
+        return state.counts[self.key] < self.count
+
+
+class GodChoice:
+    """A god can be picked while no god is chosen, and stays listed once it is the chosen one."""
+    __slots__ = ('god_id', 'signals')
+
+    def __init__(self, god_id):
+        self.god_id = god_id
+        self.signals = frozenset(['selected_god'])
+
+    def __call__(self, state):
+        return state.selected_god is None or state.selected_god == self.god_id
+
+
+class GodSelected:
+    __slots__ = ('signals',)
+
+    def __init__(self):
+        self.signals = frozenset(['selected_god'])
+
+    def __call__(self, state):
+        return state.selected_god is not None
+
+
+class GodSchool:
+    """Spells are only shown for the almen school and the school of the chosen god."""
+    __slots__ = ('school', 'signals')
+
+    def __init__(self, school):
+        self.school = school
+        self.signals = frozenset(['selected_god'])
+
+    def __call__(self, state):
+        return self.school == 'almen' or self.school == state.god_school
+
+
+class SchoolLevels:
+    """The highest almen and god school spell grades must reach the required levels."""
+    __slots__ = ('spell_type', 'almen', 'god_school', 'signals')
+
+    def __init__(self, spell_type, almen, god_school):
+        self.spell_type = spell_type
+        self.almen = almen
+        self.god_school = god_school
+        self.signals = frozenset(['selected_god', ('type', spell_type)])
+
+    def __call__(self, state):
+        return (state.max_grade(self.spell_type, 'almen') >= self.almen
+                and state.max_grade(self.spell_type, state.god_school) >= self.god_school)
+
+
+class RecipeGrade:
+    """Alchemy recipes of a grade need enough recipes of the grade below, and no more than that of their own."""
+    __slots__ = ('grade', 'required', 'signals')
+
+    def __init__(self, grade, required):
+        self.grade = grade
+        self.required = required
+        self.signals = frozenset([('type_grade', None, grade - 1), ('type_grade', None, grade)])
+
+    def __call__(self, state):
+        previous = state.counts[('type_grade', None, self.grade - 1)]
+        if previous < self.required:
+            return False
+        return self.grade == 1 or state.counts[('type_grade', None, self.grade)] < previous
+
+
+class SecondSchool:
+    """One first-grade school may be picked freely; a second one needs a third-grade school first."""
+    __slots__ = ('bit', 'first_grades', 'third_grades', 'signals')
+
+    def __init__(self, ability_id, first_grades, third_grades, catalog):
+        self.bit = catalog.mask([ability_id])
+        self.first_grades = catalog.mask(first_grades)
+        self.third_grades = catalog.mask(third_grades)
+        self.signals = frozenset(first_grades) | frozenset(third_grades)
+
+    def __call__(self, state):
+        owned = self.first_grades & state.owned
+        if not owned or owned & self.bit:
+            return True
+        if owned & (owned - 1) == 0:
+            # Exactly one first-grade school is owned
+            return state.owned & self.third_grades != 0
+        return False
+
+
+NEVER = Always(False)
+ALWAYS = Always(True)
+
+
+# The canonical form every prerequisite is normalized into when the catalog loads, whatever shape the
+# JSON had. Ids are tuples, thresholds are ints, and kind says which rule is built around the plain
+# requirements:
+#   "requirements"   only the plain requirements below
+#   "never"          not offered at all
+#   "god"            a god choice
+#   "codex"          a paladin codex, one of them at Paladin Grad 4
+#   "divine"         a paladin/priest spell or ability; params = (spell type, school, almen grade, god school grade)
+#   "recipe"         an alchemy recipe; params = (grade, recipes of the grade below required)
+#   "second_school"  a first-grade wizard school; params = (first-grade school ids, third-grade school ids)
+# Besides that: all of `ids`, one of each group in `any_ids`, at least `lp_max` LP, at least n owned
+# abilities for every (aggregate key, n) in `counts`, every nested prerequisite in `all_of` and one of
+# those in `any_of`.
+Prerequisite = namedtuple('Prerequisite', ['kind', 'ids', 'any_ids', 'lp_max', 'counts', 'all_of', 'any_of', 'params'],
+                          defaults=((), (), 0, (), (), (), ()))
+
+NO_PREREQUISITE = Prerequisite("requirements")
+NOT_OFFERED = Prerequisite("never")
+
+
+def _ids(value, ability_id, key):
+    """Prerequisites list ids either as a bare string or as a list."""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return tuple(value)
+    raise ValueError(f"{ability_id}: {key} must be an ability id or a list of ids, not {value!r}")
+
+
+def _count(value, ability_id, key):
+    if value is None:
+        return 0
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{ability_id}: {key} must be a whole number, not {value!r}")
+    return value
+
+
+def normalize_requirements(prereqs, ability_id, keys=ALL_KEYS + ANY_KEYS, kind="requirements", counts=(), params=()):
+    """Normalize the plain ability requirements of a prerequisite dict (only the given keys count)."""
+    ids = tuple(dict.fromkeys(
+        required for key in ALL_KEYS if key in keys for required in _ids(prereqs.get(key), ability_id, key)))
+    any_ids = tuple(_ids(prereqs[key], ability_id, key) for key in ANY_KEYS if key in keys and prereqs.get(key))
+    # Nested groups, for abilities that can be reached in more than one way
+    all_of = tuple(normalize_requirements(group, ability_id, keys) for group in prereqs.get('all_of') or ())
+    any_of = tuple(normalize_requirements(group, ability_id, keys) for group in prereqs.get('any_of') or ())
+    lp_max = _count(prereqs.get('lp_max_needed'), ability_id, 'lp_max_needed')
+    return Prerequisite(kind, ids, any_ids, lp_max, counts, all_of, any_of, params)
+
+
+def _standard_prerequisite(ability, prereqs, abilities):
+    if prereqs is None:
+        return NO_PREREQUISITE
+    if not isinstance(prereqs, dict):
+        return NOT_OFFERED
+    return normalize_requirements(prereqs, ability['id'])
+
+
+def _requirements_prerequisite(ability, prereqs, abilities):
+    # Shaman and warrior abilities only use plain requirements
+    return normalize_requirements(prereqs if isinstance(prereqs, dict) else {}, ability['id'])
+
+
+def _divine_prerequisite(ability, prereqs, abilities):
+    # Paladins and priests pick a god before anything else is shown
+    if 'god' in ability['type']:
+        return Prerequisite("god")
+    if ability['type'] == 'codex':
+        # Codices are picked at Paladin Grad 4, and only one of them
+        return Prerequisite("codex", ids=("paladin_level_4",))
+
+    prereqs = prereqs if isinstance(prereqs, dict) else {}
+    spell_reqs = prereqs.get('requires_spells') or {}
+    almen = _count(spell_reqs.get('almen'), ability['id'], 'requires_spells.almen')
+    god_school = _count(spell_reqs.get('gudeskole'), ability['id'], 'requires_spells.gudeskole')
+    spell_type = next(a['type'] for a in abilities if 'school' in a)
+    return normalize_requirements(prereqs, ability['id'], keys=('requires_ability',), kind="divine",
+                                  params=(spell_type, ability.get('school'), almen, god_school))
+
+
+def _grade_prerequisite(ability, prereqs, abilities):
+    """Druids, witches and runesmiths: grade abilities need spells of the grade below."""
+    ability_id = ability['id']
+    ability_type = ability.get('type')
+    prereqs = prereqs if isinstance(prereqs, dict) else {}
+
+    if ability_type in ("druid_ability", "witch_ability", "runesmith_ability"):
+        counts = ()
+        grade = _count(prereqs.get('grade'), ability_id, 'grade')
+        if grade:
+            spell_type = ability_type.replace("_ability", "_spell")
+            required = _count(prereqs.get('lower_level_spells_required', 2), ability_id, 'lower_level_spells_required')
+            counts = ((('type_grade', spell_type, grade), required),)
+        return normalize_requirements(prereqs, ability_id, keys=('requires_ability', 'required_ability'), counts=counts)
+
+    if ability_type == "witch_ritual":
+        counts = []
+        spells = _count(prereqs.get('requires_spells'), ability_id, 'requires_spells')
+        if spells:
+            counts.append((('type', 'witch_spell'), spells))
+        blood_rituals = _count(prereqs.get('requires_blood_rituals'), ability_id, 'requires_blood_rituals')
+        if blood_rituals:
+            counts.append((('type', 'witch_ritual'), blood_rituals))
+        return normalize_requirements(prereqs, ability_id, keys=('requires_spell',), counts=tuple(counts))
+
+    if ability_type == "witch_spell" and ability.get('grade', 0) <= 1:
+        return NO_PREREQUISITE
+
+    if ability_type in ("druid_spell", "witch_spell", "runesmith_spell", "runesmith_special_ability"):
+        return normalize_requirements(prereqs, ability_id, keys=('requires_ability',))
+
+    # Anything else in these files is never offered
+    return NOT_OFFERED
+
+
+def _wizard_prerequisite(ability, prereqs, abilities):
+    ability_id = ability['id']
+    ability_type = ability.get('type')
+    prereqs = prereqs if isinstance(prereqs, dict) else {}
+
+    if ability_type == "wizard_ability" and ability.get('grade') == 1:
+        first_grades = tuple(a['id'] for a in abilities if a.get('type') == "wizard_ability" and a.get('grade') == 1)
+        third_grades = tuple(a['id'] for a in abilities if a.get('type') == "wizard_ability" and a.get('grade') == 3)
+        return Prerequisite("second_school", params=(first_grades, third_grades))
+
+    if ability_type == "wizard_ability":
+        # A school grade needs as many spells from the school and from almen as the grade
+        counts = ()
+        grade = _count(ability.get('grade'), ability_id, 'grade')
+        if grade:
+            counts = ((('type_school', 'wizard_spell', ability.get('school')), grade),
+                      (('type_school', 'wizard_spell', 'almen'), grade))
+        return normalize_requirements(prereqs, ability_id, keys=('requires_ability',), counts=counts)
+
+    if ability_type == "wizard_spell":
+        counts = ()
+        school_level = _count(prereqs.get('requires_any_school_level'), ability_id, 'requires_any_school_level')
+        if school_level:
+            # Almen spells need a school of the same grade, whichever school it is
+            counts = ((('type_grade', 'wizard_ability', school_level), 1),)
+        return normalize_requirements(prereqs, ability_id, keys=('requires_ability',), counts=counts)
+
+    if ability_type == "wizard_special_ability":
+        return normalize_requirements(prereqs, ability_id, keys=('requires_spell',))
+
+    return NOT_OFFERED
+
+
+def _alchemy_prerequisite(ability, prereqs, abilities):
+    ability_id = ability['id']
+    prereqs = prereqs if isinstance(prereqs, dict) else {}
+    kind, params = "requirements", ()
+    if prereqs.get('lower_level_recipes_required') is not None and prereqs.get('grade') is not None:
+        kind = "recipe"
+        params = (_count(prereqs['grade'], ability_id, 'grade'),
+                  _count(prereqs['lower_level_recipes_required'], ability_id, 'lower_level_recipes_required'))
+    return normalize_requirements(prereqs, ability_id, keys=('requires_abilities',), kind=kind, params=params)
+
+
+# How the prerequisites of each file are read; files not listed here use the standard shape
+FILE_PREREQUISITES = {
+    "alkymi.json": _alchemy_prerequisite,
+    "paladin.json": _divine_prerequisite,
+    "præst.json": _divine_prerequisite,
+    "kriger.json": _requirements_prerequisite,
+    "druide.json": _grade_prerequisite,
+    "heks.json": _grade_prerequisite,
+    "runesmed.json": _grade_prerequisite,
+    "shaman.json": _requirements_prerequisite,
+    "trolddom.json": _wizard_prerequisite,
+}
+
+
+def normalize_prerequisites(abilities, file_key):
+    """Normalize the prerequisite of every ability in a file, keyed by ability id."""
+    normalize = FILE_PREREQUISITES.get(file_key, _standard_prerequisite)
+    prerequisites = {}
+    for ability in abilities:
+        if ability['id'] not in prerequisites:
+            prerequisites[ability['id']] = normalize(ability, ability.get('prerequisite', {}), abilities)
+    return prerequisites
+
+
+def _combine(rules):
+    rules = [rule for rule in rules if rule is not ALWAYS]
+    if any(rule is NEVER for rule in rules):
+        return NEVER
+    if not rules:
+        return ALWAYS
+    if len(rules) == 1:
+        return rules[0]
+    return AllOf(rules)
+
+
+def compile_prerequisite(prerequisite, ability_id, catalog):
+    """Build the rule for a normalized prerequisite."""
+    kind = prerequisite.kind
+    if kind == "never":
+        return NEVER
+    if kind == "god":
+        return GodChoice(ability_id)
+
+    rules = []
+    if kind == "codex":
+        rules += [GodSelected(), CountBelow(('type', 'codex'), 1)]
+    elif kind == "divine":
+        spell_type, school, almen, god_school = prerequisite.params
+        rules.append(GodSelected())
+        if school is not None:
+            rules.append(GodSchool(school))
+        if almen or god_school:
+            rules.append(SchoolLevels(spell_type, almen, god_school))
+    elif kind == "recipe":
+        rules.append(RecipeGrade(*prerequisite.params))
+    elif kind == "second_school":
+        rules.append(SecondSchool(ability_id, *prerequisite.params, catalog))
+
+    if prerequisite.ids:
+        rules.append(OwnsAll(prerequisite.ids, catalog))
+    rules += [OwnsAny(group, catalog) for group in prerequisite.any_ids]
+    if prerequisite.lp_max:
+        rules.append(LpMaxAtLeast(prerequisite.lp_max))
+    rules += [CountAtLeast(key, count) for key, count in prerequisite.counts]
+    if prerequisite.all_of:
+        rules.append(_combine(compile_prerequisite(group, ability_id, catalog) for group in prerequisite.all_of))
+    if prerequisite.any_of:
+        rules.append(AnyOf(compile_prerequisite(group, ability_id, catalog) for group in prerequisite.any_of))
+    return _combine(rules)
+
+
+def compile_rules(prerequisites, catalog):
+    """Compile normalized prerequisites into rules, keyed by ability id."""
+    return {ability_id: compile_prerequisite(prerequisite, ability_id, catalog)
+            for ability_id, prerequisite in prerequisites.items()}
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+from evnekatalog import MENU_UNLOCKS, get_catalog
+from evneregler import aggregate_keys
+
+
+def referenced_ids(prerequisite):
+    """Every id a prerequisite mentions, whether it is strictly needed or one of several alternatives."""
+    yield from prerequisite.ids
+    for group in prerequisite.any_ids:
+        yield from group
+    for nested in prerequisite.all_of + prerequisite.any_of:
+        yield from referenced_ids(nested)
+
+
+def required_ids(prerequisite):
+    """The ids a prerequisite always needs, leaving out the any-of alternatives."""
+    yield from prerequisite.ids
+    for nested in prerequisite.all_of:
+        yield from required_ids(nested)
+
+
+def dangling_references(catalog):
+    """(ability id, missing id) for requirements that point at ids no file defines."""
+    return [(ability_id, referenced)
+            for ability_id, prerequisite in catalog.prerequisites.items()
+            for referenced in dict.fromkeys(referenced_ids(prerequisite))
+            if referenced not in catalog]
+
+
+def find_cycles(catalog):
+    """Groups of abilities that (directly or through each other) require themselves."""
+    graph = {ability_id: [referenced for referenced in referenced_ids(prerequisite) if referenced in catalog]
+             for ability_id, prerequisite in catalog.prerequisites.items()}
+
+    # Tarjan's strongly connected components, without recursion since the chains can be long
+    index, lowlink, on_stack, stack, cycles = {}, {}, set(), [], []
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, edges = work[-1]
+            for neighbour in edges:
+                if neighbour not in index:
+                    index[neighbour] = lowlink[neighbour] = len(index)
+                    stack.append(neighbour)
+                    on_stack.add(neighbour)
+                    work.append((neighbour, iter(graph[neighbour])))
+                    break
+                if neighbour in on_stack:
+                    lowlink[node] = min(lowlink[node], index[neighbour])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph[node]:
+                        cycles.append(sorted(component))
+    return cycles
+
+
+class _Reachable:
+    """The abilities some legal build could own, grown until nothing more can be added."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.owned = set()
+        self.counts = Counter()
+        self.max_grades = {}
+        self.god_schools = {ability_id.replace("god_", "") for ability_id, ability in catalog.by_id.items()
+                            if ability.get('type') == 'god'}
+
+    def add(self, ability_id):
+        ability = self.catalog.by_id[ability_id]
+        self.owned.add(ability_id)
+        for key in aggregate_keys(ability):
+            self.counts[key] += 1
+        if 'school' in ability:
+            key = (ability.get('type'), ability['school'])
+            self.max_grades[key] = max(self.max_grades.get(key, 0), ability.get('grade', 0))
+
+    def max_grade(self, ability_type, school):
+        return self.max_grades.get((ability_type, school), 0)
+
+    def possible(self, prerequisite):
+        """Whether the prerequisite can be met by some choice among the reachable abilities.
+
+        This errs on the side of "possible": the LP maximum, the one-codex limit, the second wizard
+        school and which god is chosen are assumed to work out.
+        """
+        kind = prerequisite.kind
+        if kind == "never":
+            return False
+        if kind == "divine":
+            spell_type, school, almen, god_school = prerequisite.params
+            if school not in (None, 'almen') and school not in self.god_schools:
+                return False
+            if self.max_grade(spell_type, 'almen') < almen:
+                return False
+            # The god school level counts the school of the chosen god; almen spells may use any god
+            schools = self.god_schools if school in (None, 'almen') else {school}
+            if god_school and not any(self.max_grade(spell_type, s) >= god_school for s in schools):
+                return False
+        if kind == "recipe":
+            grade, required = prerequisite.params
+            if self.counts[('type_grade', None, grade - 1)] < required:
+                return False
+
+        return (all(required in self.owned for required in prerequisite.ids)
+                and all(not self.owned.isdisjoint(group) for group in prerequisite.any_ids)
+                and all(self.counts[key] >= count for key, count in prerequisite.counts)
+                and all(self.possible(nested) for nested in prerequisite.all_of)
+                and (not prerequisite.any_of or any(self.possible(nested) for nested in prerequisite.any_of)))
+
+
+def unreachable_abilities(catalog):
+    """Abilities no legal build can ever reach, in catalog order.
+
+    An ability in a class file also needs the ability that opens that menu, as in the builder.
+    """
+    gates = {os.path.basename(file): ability_id for ability_id, (_, file) in MENU_UNLOCKS.items()}
+    reachable = _Reachable(catalog)
+
+    def menu_open(ability_id):
+        gate = gates.get(catalog.source[ability_id])
+        return gate is None or gate in reachable.owned
+
+    remaining = list(catalog.prerequisites)
+    while True:
+        newly_reached = [ability_id for ability_id in remaining
+                         if menu_open(ability_id) and reachable.possible(catalog.prerequisites[ability_id])]
+        if not newly_reached:
+            return remaining
+        for ability_id in newly_reached:
+            reachable.add(ability_id)
+        remaining = [ability_id for ability_id in remaining if ability_id not in reachable.owned]
+
+
+def _closure(edges):
+    """Everything reachable from each node of a graph, following the edges transitively."""
+    closure = {}
+    for start in edges:
+        seen = set()
+        pending = list(edges[start])
+        while pending:
+            node = pending.pop()
+            if node in seen or node == start:
+                continue
+            seen.add(node)
+            pending.extend(edges.get(node, ()))
+        closure[start] = sorted(seen)
+    return closure
+
+
+def requires_closure(catalog):
+    """Ability id -> every ability it needs, directly or through its own requirements."""
+    return _closure({ability_id: [required for required in required_ids(prerequisite) if required in catalog]
+                     for ability_id, prerequisite in catalog.prerequisites.items()})
+
+
+def unlocks_closure(catalog):
+    """Ability id -> every ability whose prerequisites it eventually counts towards."""
+    return _closure({ability_id: catalog.affected_by([ability_id]) - {ability_id}
+                     for ability_id in catalog.prerequisites})
+
+
+def lint(catalog):
+    """Return the report lines for every problem found; an empty list means the catalog is clean."""
+    problems = []
+    for ability_id, missing in dangling_references(catalog):
+        problems.append(f"{catalog.source[ability_id]}: {ability_id} requires unknown ability {missing}")
+    for cycle in find_cycles(catalog):
+        problems.append(f"Prerequisite cycle between {', '.join(cycle)}")
+    for ability_id in unreachable_abilities(catalog):
+        problems.append(f"{catalog.source[ability_id]}: {ability_id} can never be reached")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tjek evnefilerne i Filer/ for fejl i forudsætningerne.")
+    parser.add_argument("--mappe", default="Filer", help="mappen med evnefilerne (standard: Filer)")
+    parser.add_argument("--tabeller", metavar="FIL",
+                        help="skriv tabellerne over hvad hver evne kræver og låser op for til en .json-fil")
+    args = parser.parse_args(argv)
+
+    catalog = get_catalog(args.mappe)
+    problems = lint(catalog)
+    for problem in problems:
+        print(problem)
+    print(f"{len(catalog)} abilities checked, {len(problems)} problems found")
+
+    if args.tabeller:
+        with open(args.tabeller, 'w', encoding='utf-8') as file:
+            json.dump({"requires": requires_closure(catalog), "unlocks": unlocks_closure(catalog)},
+                      file, indent=4, ensure_ascii=False)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
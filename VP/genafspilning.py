@@ -0,0 +1,231 @@
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+from evnekatalog import get_catalog
+from karakterbygger import Character
+from klasseressourcer import RESOURCES
+from sessionslog import read_session
+from VP_evner import AbilityManager
+
+
+class _StubWidget:
+    """Takes any widget call (config, pack, destroy, ...) and does nothing."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _StubCanvas(_StubWidget):
+    """Just enough of a Tk canvas for AbilityManager to draw its rows on."""
+
+    def __init__(self):
+        self.items = 0
+
+    def winfo_width(self):
+        return 400
+
+    def winfo_height(self):
+        return 600
+
+    def canvasy(self, y):
+        return y
+
+    def create_rectangle(self, *coords, **options):
+        self.items += 1
+        return self.items
+
+    create_text = create_rectangle
+
+
+class HeadlessApp:
+    """Stands in for CharacterApp: the class resource texts are worked out, but not shown."""
+
+    def __init__(self, character):
+        self.character = character
+        self.class_info = {}  # class name -> resource text
+
+    def update_class_info(self, class_name):
+        if class_name in RESOURCES:
+            self.class_info[class_name] = self.character.resources.text(class_name)
+
+
+class HeadlessAbilityManager(AbilityManager):
+    """An AbilityManager without any Tk widgets, so its logic can run and be timed without a display.
+
+    Where the player would be asked to pick a free ability, choose(ability_list, prompt_message)
+    decides; by default the first option is taken. opened(manager) is called for every menu window
+    the manager opens.
+    """
+
+    render_in_chunks = False  # There is no event loop to draw the rest of a menu from
+
+    def __init__(self, character, ability_file, app=None, catalog=None, choose=None, opened=None):
+        self.app = app if app is not None else HeadlessApp(character)
+        self.character = character
+        self.root = _StubWidget()
+        self.ability_file = ability_file
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.ability_data = self.load_abilities(ability_file)
+        self.new_menu_buttons = {}
+        self.ep_label = _StubWidget()
+        self.selected_god = self.character.selected_god
+        self.ability_canvas = _StubCanvas()
+        self.ability_scrollbar = _StubWidget()
+        self.row_items = []
+        self.shown_positions = []
+        self.render_job = None
+        self.choose = choose or (lambda ability_list, prompt_message: ability_list[0] if ability_list else None)
+        self.opened = opened
+        self.tabs = None
+        self.errors = []  # Messages the player would have been shown
+        self.update_ability_buttons()
+
+    def show_error(self, message):
+        self.errors.append(message)
+
+    def prompt_ability_choice(self, ability_list, prompt_message):
+        return self.choose(ability_list, prompt_message)
+
+    def create_new_menu_button(self, name, file):
+        self.new_menu_buttons.setdefault(name, _StubWidget())
+
+    def open_menu_window(self, ability_file, app):
+        manager = HeadlessAbilityManager(self.character, ability_file, app, self.catalog, self.choose, self.opened)
+        if self.opened:
+            self.opened(manager)
+        return manager
+
+
+class Replay:
+    """Repeats a recorded session against the builder's logic, without a display.
+
+    Saves go to a temporary directory. RuntimeError is raised if the session can't be repeated,
+    e.g. because the ability files have changed so a recorded choice is no longer on offer.
+    """
+
+    def __init__(self, entries, catalog=None):
+        self.entries = entries
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.character = None
+        self.managers = {}  # ability file -> the latest manager opened for it
+        self.times = {}  # action -> [count, total seconds]
+
+    def run(self):
+        self.pending = deque(self.entries)
+        with tempfile.TemporaryDirectory() as self.save_directory:
+            while self.pending:
+                entry = self.pending.popleft()
+                handler = getattr(self, f"replay_{entry['action']}", None)
+                if handler is None:
+                    raise RuntimeError(f"Can't replay {entry['action']!r} at t={entry.get('t')}")
+                start = time.perf_counter()
+                handler(entry)
+                times = self.times.setdefault(entry['action'], [0, 0.0])
+                times[0] += 1
+                times[1] += time.perf_counter() - start
+        return self.times
+
+    def choose(self, ability_list, prompt_message):
+        """The recorded answer to a free ability prompt, which must be the next entry of the log."""
+        if not self.pending or self.pending[0]['action'] != "choice":
+            raise RuntimeError(f"The replay asks {prompt_message!r}, which the recorded session did not")
+        chosen = self.pending.popleft()['ability']
+        if chosen is None:
+            return None
+        for ability in ability_list:
+            if ability['id'] == chosen:
+                return ability
+        raise RuntimeError(f"Recorded choice {chosen} is not one of the options for {prompt_message!r}")
+
+    def manager(self, ability_file):
+        manager = self.managers.get(ability_file)
+        if manager is None:
+            raise RuntimeError(f"The recorded session used the menu {ability_file}, which the replay has not opened")
+        return manager
+
+    def opened(self, manager):
+        self.managers[manager.ability_file] = manager
+
+    def replay_load(self, entry):
+        self.character = Character(self.catalog)
+        self.character.load_from_data(entry['character'])
+        self.managers = {}
+        app = HeadlessApp(self.character)
+        manager = HeadlessAbilityManager(self.character, "Filer/standardevner.json", app, self.catalog,
+                                         self.choose, self.opened)
+        self.opened(manager)
+        for ability_id in self.character.abilities:
+            manager.check_menu_unlocks(ability_id)
+
+    def replay_purchase(self, entry):
+        manager = self.manager(entry['menu'])
+        manager.purchase_ability(self.catalog.abilities(entry['menu']).by_id[entry['ability']])
+
+    def replay_open_menu(self, entry):
+        self.manager(entry['menu']).open_new_menu(entry['file'])
+
+    def replay_choice(self, entry):
+        raise RuntimeError(f"The recorded session chose {entry['ability']} at t={entry['t']}, but the replay was not asked")
+
+    def replay_save(self, entry):
+        self.character.save_to_file(os.path.join(self.save_directory, os.path.basename(entry['file'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Afspil en optaget session (VP_SESSIONSLOG) uden skærm.")
+    parser.add_argument("session", help="sessionslog (.jsonl) optaget med VP_SESSIONSLOG=fil python VP_evner.py")
+    parser.add_argument("--profil", choices=["cprofile", "tracemalloc"], help="kør afspilningen under en profiler")
+    parser.add_argument("--top", type=int, default=25, help="antal linjer i profilen (standard: 25)")
+    parser.add_argument("--gem", metavar="FIL", help="gem cProfile-data til en fil, f.eks. til snakeviz")
+    parser.add_argument("--maks", type=float, metavar="SEKUNDER",
+                        help="fejl (exit 1) hvis afspilningen tager længere tid end dette")
+    args = parser.parse_args(argv)
+
+    entries = read_session(args.session)
+    start = time.perf_counter()
+    catalog = get_catalog()
+    print(f"Catalog loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    replay = Replay(entries, catalog)
+    profiler = None
+    if args.profil == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profil == "tracemalloc":
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    times = replay.run()
+    elapsed = time.perf_counter() - start
+
+    if profiler is not None:
+        profiler.disable()
+        if args.gem:
+            profiler.dump_stats(args.gem)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
+    elif args.profil == "tracemalloc":
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for statistic in snapshot.statistics("lineno")[:args.top]:
+            print(statistic)
+        print(f"Memory in use: {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB")
+
+    for action, (count, total) in times.items():
+        print(f"{action:12} {count:6} x {total * 1000:10.1f} ms")
+    print(f"Replayed {len(entries)} entries in {elapsed * 1000:.1f} ms")
+    if args.maks is not None and elapsed > args.maks:
+        print(f"Slower than the limit of {args.maks} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
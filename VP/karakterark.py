@@ -1,9 +1,27 @@
 import tkinter as tk
 from tkinter import filedialog
+import argparse
+import glob
+import io
 import json
+import multiprocessing
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 import os
+from evnekatalog import get_catalog
+from klasseressourcer import ResourceTotals
+
+# Class-specific ability files
+CLASS_FILES = [
+    "Filer/alkymi.json", "Filer/druide.json", "Filer/heks.json", "Filer/kriger.json",
+    "Filer/paladin.json", "Filer/præst.json", "Filer/runesmed.json", "Filer/shaman.json", "Filer/trolddom.json"
+]
+
+# Sheet class names -> the class names the resource calculator uses
+RESOURCE_CLASSES = {"Druide": "Druid", "Trolddom": "Wizard", "Præst": "Priest", "Paladin": "Paladin", "Heks": "Witch"}
 
 def load_json_file(file_path=None):
     """Helper function to load a JSON file."""
@@ -49,25 +67,54 @@ def create_pdf(character_data, file_path):
 
     return c
 
-def get_ability_name(ability_id, standard_abilities, class_files=None):
-    # First, look in standard abilities
-    for ability in standard_abilities:
-        if ability['id'] == ability_id:
-            return ability['name']
+AbilityInfo = namedtuple('AbilityInfo', ['name', 'class_name', 'grade', 'type'])
+
+
+def get_class_name(class_file):
+    """'Filer/præst.json' -> 'Præst'"""
+    return class_file.split('/')[-1].split('.')[0].capitalize()
+
 
-    # If not found, optionally look in class files if provided
-    if class_files:
+class AbilityIndex:
+    """The standard and class abilities from the shared catalog, indexed by id."""
+
+    def __init__(self, catalog, class_files):
+        self.standard = {}  # id -> AbilityInfo for the standard abilities
+        self.classes = {}   # class name -> {id -> AbilityInfo}, in the order of class_files
+        self.by_id = {}     # id -> AbilityInfo, standard abilities first and then the class files in order
+        self._add(self.standard, catalog.abilities("Filer/standardevner.json"), None)
         for class_file in class_files:
-            class_abilities = load_json_file(class_file)
-            for ability in class_abilities:
-                if ability['id'] == ability_id:
-                    return ability['name']
-    
-    # Return the ID as fallback if name not found
-    return "None"
+            class_name = get_class_name(class_file)
+            self._add(self.classes.setdefault(class_name, {}), catalog.abilities(class_file), class_name)
+
+    def _add(self, abilities_by_id, abilities, class_name):
+        for ability in abilities:
+            # The first entry wins, both within a file and across files
+            info = AbilityInfo(ability['name'], class_name, ability.get('grade'), ability.get('type'))
+            abilities_by_id.setdefault(ability['id'], info)
+            self.by_id.setdefault(ability['id'], info)
+
 
+_ability_index = None
 
-def process_general_abilities(character_data, standard_abilities):
+
+def get_ability_index():
+    """The ability index for this run (or this batch worker process), built on first use."""
+    global _ability_index
+    if _ability_index is None:
+        _ability_index = AbilityIndex(get_catalog(), CLASS_FILES)
+    return _ability_index
+
+
+def get_ability_name(ability_id, abilities_by_id):
+    info = abilities_by_id.get(ability_id)
+    if info is None:
+        # Return "None" as fallback if name not found
+        return "None"
+    return info.name
+
+
+def process_general_abilities(character_data, ability_index):
     left_column_abilities = {}
 
     # Iterate through character abilities and group by base ability ID (before the last '_')
@@ -89,7 +136,7 @@ def process_general_abilities(character_data, standard_abilities):
             # Non-leveled abilities (without an integer suffix)
             left_column_abilities[ability_id] = None  # No level, but we still want to track it
 
-    # Retrieve the names for the abilities using only standard_abilities
+    # Retrieve the names for the abilities using only the standard abilities
     named_abilities = {}
     for base_id, level in left_column_abilities.items():
         if level is not None:
@@ -100,18 +147,17 @@ def process_general_abilities(character_data, standard_abilities):
             ability_id = base_id
 
         # Fetch the ability name using the ID
-        ability_name = get_ability_name(ability_id, standard_abilities)
+        ability_name = get_ability_name(ability_id, ability_index.standard)
         if ability_name != "None":
             named_abilities[ability_name] = level
     return named_abilities
 
 
-def process_class_abilities(character_data, class_files, standard_abilities, calculate_stat_fn):
+def process_class_abilities(character_data, ability_index, calculate_stat_fn):
     right_column_data = {}
+    resources = ResourceTotals(get_catalog(), character_data['abilities'])
 
-    for class_file in class_files:
-        class_name = class_file.split('/')[-1].split('.')[0].capitalize()
-        class_abilities = load_json_file(class_file)
+    for class_name, class_abilities in ability_index.classes.items():
 
         # Track the highest "Grad" ability
         grad_abilities = {}
@@ -120,9 +166,9 @@ def process_class_abilities(character_data, class_files, standard_abilities, cal
         class_abilities_in_character = []
         for ability_id in character_data['abilities']:
             # Check if the ability ID is in the class abilities
-            if ability_id in [ca['id'] for ca in class_abilities]:
+            if ability_id in class_abilities:
                 # Fetch the name using the ID
-                ability_name = get_ability_name(ability_id, standard_abilities, class_files)
+                ability_name = get_ability_name(ability_id, ability_index.by_id)
 
                 # Handle "Grad " logic here (for abilities with levels)
                 if "Grad " in ability_name and " Grad" in ability_name:
@@ -146,118 +192,15 @@ def process_class_abilities(character_data, class_files, standard_abilities, cal
             right_column_data[class_name] = {
                 "grad_abilities": grad_ability_list,
                 "abilities": class_abilities_in_character,
-                "stat": calculate_stat_fn(character_data, class_name, class_abilities_in_character)
+                "stat": calculate_stat_fn(character_data, class_name, class_abilities_in_character, resources)
             }
 
     return right_column_data
 
 
-def calculate_stat_fn(character_data, class_name, abilities):
-    if class_name == "Druide":
-        ability_file = "Filer/druide.json"
-        total_hjerteslag = 2  # Start with 2        
-        # Load the druid abilities from Filer/druide.json
-        ability_data = load_json_file(ability_file)
-            
-        # Iterate through character abilities
-        for ability_id in character_data['abilities']:
-                
-            # Check for abilities with "druid_ability" in their ID
-            if "druid_ability" in ability_id:
-                # Get the last character of the ID, which should be a number between 2 and 6
-                last_char = ability_id[-1]
-                if last_char.isdigit() and 2 <= int(last_char) <= 6:
-                    total_hjerteslag += int(last_char)
-                
-            # Check for abilities with "druid_spell" in their ID
-            elif "druid_spell" in ability_id:
-                # Find the corresponding ability in Filer/druide.json
-                spell = next((a for a in ability_data if a['id'] == ability_id), None)
-                if spell and 'grade' in spell:
-                    total_hjerteslag += spell['grade']
-        
-        return "(Hjerteslag: " + str(total_hjerteslag)+")"
-    elif class_name == "Trolddom":
-        # Load the wizard abilities from Filer/trolddom.json
-        ability_file = "Filer/trolddom.json"
-        ability_data = load_json_file(ability_file)
-
-        # Initialize total mana
-        total_mana = 0
-
-        # Loop through character abilities
-        for ability_id in character_data['abilities']:
-            # Check if the ability is a wizard spell
-            if "wizard_spell" in ability_id:
-                # Find the corresponding ability in Filer/trolddom.json to get its grade
-                spell = next((a for a in ability_data if a['id'] == ability_id), None)
-                if spell:
-                    # Add mana based on the grade (3 mana per grade level)
-                    total_mana += spell['grade'] * 3
-
-            # Check if the ability is a wizard ekstra mana
-            elif "wizard_ekstra_mana" in ability_id:
-                # Add 6 mana for each ekstra mana ability
-                total_mana += 6
-        return "(Mana: " + str(total_mana)+")"
-    elif class_name == "Præst":
-        total_gudetro = 0  # Start with 0
-        
-        # Load the priest abilities from Filer/præst.json
-        ability_file = "Filer/præst.json"
-        ability_data = load_json_file(ability_file)
-            
-        # Iterate through character abilities
-        for ability_id in character_data['abilities']:
-                
-            # Check for abilities with "priest_spell" in their ID
-            if "priest_spell" in ability_id:
-                # Find the corresponding ability in Filer/præst.json
-                spell = next((a for a in ability_data if a['id'] == ability_id), None)
-                if spell and 'grade' in spell:
-                    total_gudetro += spell['grade'] * 3
-        return "(Gudetro: " + str(total_gudetro)+")"
-    elif class_name == "Paladin":
-        total_tro = 0  # Start with 0
-        
-        # Load the paladin abilities from Filer/paladin.json
-        ability_file = "Filer/paladin.json"
-        ability_data = load_json_file(ability_file)
-            
-        # Iterate through character abilities
-        for ability_id in character_data['abilities']:
-                
-            # Check for abilities with "paladin_spell" in their ID
-            if "paladin_spell" in ability_id:
-                # Find the corresponding ability in Filer/paladin.json
-                spell = next((a for a in ability_data if a['id'] == ability_id), None)
-                if spell and 'grade' in spell:
-                    total_tro += spell['grade'] * 3
-        return "(Tro: " + str(total_tro)+")"
-    elif class_name == "Heks":
-        total_skyggeskaar = 1  # Start with 1
-        
-        # Load the witch abilities from witch.json
-        ability_file = "Filer/heks.json"
-        ability_data = load_json_file(ability_file)
-            
-        # Iterate through character abilities
-        for ability_id in character_data['abilities']:
-                
-            # Check for abilities with "witch_ability" in their ID
-            if "witch_ability" in ability_id:
-                # Get the last character of the ID, which should be a number
-                last_char = ability_id[-1]
-                if last_char.isdigit():
-                    total_skyggeskaar += int(last_char)
-                
-            # Check for abilities with "witch_spell" in their ID
-            elif "witch_spell" in ability_id:
-                # Find the corresponding ability in witch.json
-                spell = next((a for a in ability_data if a['id'] == ability_id), None)
-                if spell and 'grade' in spell:
-                    total_skyggeskaar += spell['grade']
-        return "(Skyggeskår: " + str(total_skyggeskaar)+")"
+def calculate_stat_fn(character_data, class_name, abilities, resources):
+    if class_name in RESOURCE_CLASSES:
+        return "(" + resources.text(RESOURCE_CLASSES[class_name]) + ")"
     # Add other classes here
     return ""
 
@@ -340,24 +283,75 @@ def add_abilities_to_pdf(c, general_abilities, class_abilities, starting_height)
         current_y -= row_height
 
 
-def main():
-    # Load the character JSON interactively
-    character_data = load_json_file()
+def write_character_sheet(character_data, file_path, ability_index):
+    """Render the sheet for one character and save it as a PDF."""
+    # Process general abilities (only from standardevner.json)
+    general_abilities = process_general_abilities(character_data, ability_index)
 
-    # Load standard abilities from the specific JSON file
-    standard_abilities = load_json_file("Filer/standardevner.json")
+    # Class-specific abilities
+    class_abilities = process_class_abilities(character_data, ability_index, calculate_stat_fn)
 
-    # Class-specific files (just an example)
-    class_files = [
-        "Filer/alkymi.json", "Filer/druide.json", "Filer/heks.json", "Filer/kriger.json",
-        "Filer/paladin.json", "Filer/præst.json", "Filer/runesmed.json", "Filer/shaman.json", "Filer/trolddom.json"
-    ]
-    
-    # Process general abilities (only from standardevner.json)
-    general_abilities = process_general_abilities(character_data, standard_abilities)
+    # Add header info and calculated EP
+    c = create_pdf(character_data, file_path)
+
+    # Add the abilities to the PDF
+    add_abilities_to_pdf(c, general_abilities, class_abilities, 750)
+
+    c.save()
+
+
+def render_character_sheet(character_data):
+    """Render the sheet for one character and return the PDF as bytes."""
+    buffer = io.BytesIO()
+    write_character_sheet(character_data, buffer, get_ability_index())
+    return buffer.getvalue()
+
+
+def find_character_files(paths):
+    """Expand the given files and directories (e.g. "Mine karakterer/") into character JSON files."""
+    character_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            character_files.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            character_files.append(path)
+    return character_files
+
+
+def write_sheet_for_file(character_file, output_dir=None):
+    """Batch worker: write <character name>.pdf next to the JSON file, or in output_dir if given."""
+    character_data = load_json_file(character_file)
+    base_name = os.path.splitext(os.path.basename(character_file))[0]
+    file_path = os.path.join(output_dir or os.path.dirname(character_file), base_name + ".pdf")
+    write_character_sheet(character_data, file_path, get_ability_index())
+    return file_path
+
+
+def write_sheets(paths, output_dir=None, workers=None):
+    """Write one PDF per character without any dialogs, spread over a pool of processes.
 
-    # Class-specific abilities (loaded separately)
-    class_abilities = process_class_abilities(character_data, class_files, standard_abilities, calculate_stat_fn)
+    Returns the number of characters that could not be rendered.
+    """
+    character_files = find_character_files(paths)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(write_sheet_for_file, character_file, output_dir): character_file
+                   for character_file in character_files}
+        for future in as_completed(futures):
+            try:
+                print(f"{futures[future]} -> {future.result()}")
+            except Exception as error:
+                print(f"Could not create a character sheet for {futures[future]}: {error}")
+                failed += 1
+    return failed
+
+
+def main():
+    # Load the character JSON interactively
+    character_data = load_json_file()
 
     root = tk.Tk()
     root.withdraw()  # Hide the root window
@@ -368,16 +362,22 @@ def main():
     if not file_path:  # If the user cancels, return without doing anything
         return
 
-    # Create PDF
-    c = canvas.Canvas(file_path, pagesize=A4)
-    
-    # Add header info and calculated EP
-    c = create_pdf(character_data, file_path)
-    
-    # Add the abilities to the PDF
-    add_abilities_to_pdf(c, general_abilities, class_abilities, 750)
+    write_character_sheet(character_data, file_path, get_ability_index())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lav karakterark som PDF. Uden argumenter vælges filerne i dialogbokse.")
+    parser.add_argument("characters", nargs="*",
+                        help="karakterfiler (.json) eller mapper med karakterfiler, f.eks. 'Mine karakterer'")
+    parser.add_argument("-o", "--output", help="mappe til PDF-filerne (standard: ved siden af karakterfilen)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="antal processer (standard: én pr. kerne)")
+    return parser.parse_args(argv)
 
-    c.save()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed by the pool when running as karakterark.exe
+    args = parse_args()
+    if args.characters:
+        sys.exit(1 if write_sheets(args.characters, args.output, args.jobs) else 0)
     main()
@@ -0,0 +1,672 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from evnekatalog import MENU_UNLOCKS, get_catalog
+from evneregler import AbilityCounters, PlanState, RuleState
+from klasseressourcer import ResourceTotals
+
+STANDARD_FILE = "Filer/standardevner.json"
+
+
+def save_json(filename, data, versions=0):
+    """Write data to a JSON file so that a crash leaves either the old file or the new one, never half of one.
+
+    The data goes to a temporary file in the same directory, which then replaces the file. With
+    versions, the previous contents are kept as filename.1 (the newest) up to filename.<versions>.
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, temporary)
+        if versions and os.path.exists(filename):
+            for number in range(versions - 1, 0, -1):
+                if os.path.exists(f"{filename}.{number}"):
+                    os.replace(f"{filename}.{number}", f"{filename}.{number + 1}")
+            shutil.copy2(filename, f"{filename}.1")
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class Character:
+    def __init__(self, catalog=None):
+        # Owned abilities are kept as the ordered id list saved to disk, as a bit mask over the catalog,
+        # and as running counts per type, grade and school for the prerequisite rules and class resources
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.name = ""
+        self.race = ""
+        self.lp_max = 0
+        self.abilities = []
+        self.free_spells_granted_for_paladin = False
+        self.free_spells_granted_for_priest = False
+        self.free_spells_granted_for_warrior = False
+        self.free_spells_granted_for_alchemist = False
+        self.free_spells_granted_for_witch = False
+        self.free_spells_granted_for_druid = False
+        self.free_spells_granted_for_runesmith = False
+        self.free_spells_granted_for_wizard = False
+        self.spent_ep = 0
+        self.total_ep = 1000  # Default starting EP
+        self.selected_god = None  # Track the selected god
+
+    def load_from_file(self, filename):
+        """Load the character data from a JSON file."""
+        try:
+            with open(filename, 'r', encoding='utf-8') as file:
+                self.load_from_data(json.load(file))
+        except FileNotFoundError:
+            print(f"File {filename} not found. Loading empty character.")
+        except json.JSONDecodeError:
+            print(f"Error parsing {filename}. Please check the file format.")
+
+    def load_from_data(self, data):
+        """Load the character data from a dict as stored in the JSON files."""
+        self.name = data.get('name', "")
+        self.race = data.get('race', "")
+        self.abilities = data.get('abilities', [])
+        self.lp_max = data.get('lp_max', 0)
+        self.spent_ep = data.get('spent_ep', 0)
+        self.total_ep = data.get('total_ep', 1000)
+        self.selected_god = data.get('selected_god', None)  # Load the selected god
+
+        for abilities in self.abilities:
+            if "alkymi_" in abilities:
+                self.free_spells_granted_for_alchemist = True
+            if "druid_" in abilities:
+                self.free_spells_granted_for_druid = True
+            if "witch_" in abilities:
+                self.free_spells_granted_for_witch = True
+            if "warrior_" in abilities:
+                self.free_spells_granted_for_warrior = True
+            if "paladin_" in abilities:
+                self.free_spells_granted_for_paladin = True
+            if "priest_" in abilities:
+                self.free_spells_granted_for_priest = True
+            if "runesmith_" in abilities:
+                self.free_spells_granted_for_runesmith = True
+            if "shaman_" in abilities:
+                self.free_spells_granted_for_shaman = True
+            if "wizard_" in abilities:
+                self.free_spells_granted_for_wizard = True
+
+    def save_to_file(self, filename, versions=0):
+        """Save the character data to a JSON file, keeping `versions` of its previous contents."""
+        save_json(filename, self.to_data(), versions)
+
+    def to_data(self):
+        """The character data as a dict, in the form it is saved in."""
+        return {
+            'name': self.name,
+            'race': self.race,
+            'abilities': list(self.abilities),
+            'lp_max': self.lp_max,
+            'spent_ep': self.spent_ep,
+            'total_ep': self.total_ep,
+            'selected_god': self.selected_god  # Save the selected god
+        }
+
+    def remaining_ep(self):
+        """Calculate the remaining EP."""
+        return self.total_ep - self.spent_ep
+
+    def state_key(self):
+        """What the ability menus depend on; it is different whenever the character has changed."""
+        return self.ability_mask, self.selected_god, self.lp_max, self.remaining_ep()
+
+    def snapshot(self):
+        """An immutable copy of the character for checking rules against, e.g. on another thread."""
+        return CharacterSnapshot(self)
+
+    def select_god(self, god_id):
+        """Select a god for the character, preventing multiple selections."""
+        if self.selected_god is None:
+            self.selected_god = god_id
+        else:
+            raise ValueError(f"God already selected: {self.selected_god}")
+
+
+    @property
+    def abilities(self):
+        """The ids of the owned abilities, in the order they were bought."""
+        return self._abilities
+
+    @abilities.setter
+    def abilities(self, ability_ids):
+        # Files edited by hand can list an ability twice; it is owned once, like in the mask
+        self._abilities = list(dict.fromkeys(ability_ids))
+        self.ability_mask = self.catalog.mask(self._abilities)
+        self.counters = AbilityCounters(self.catalog, self._abilities)
+        self.resources = ResourceTotals(self.catalog, self._abilities)
+
+    def has_ability(self, ability_id):
+        """Check if the character has a specific ability."""
+        index = self.catalog.bit_indices.get(ability_id)
+        return index is not None and (self.ability_mask >> index) & 1 == 1
+
+    def add_ability(self, ability_id, cost):
+        """Add an ability to the character if they have enough EP."""
+        if self.remaining_ep() >= cost:
+            if not self.has_ability(ability_id):
+                self._abilities.append(ability_id)
+                self.ability_mask |= 1 << self.catalog.bit_index(ability_id)
+                self.counters.add(ability_id)
+                self.resources.add(ability_id)
+                self.spent_ep += cost
+            else:
+                raise ValueError(f"Ability {ability_id} is already purchased.")
+        else:
+            raise ValueError(f"Not enough EP to purchase {ability_id}. Cost: {cost}, Remaining EP: {self.remaining_ep()}")
+
+    def remove_ability(self, ability_id):
+        """Remove an ability from the character and refund its cost."""
+        if self.has_ability(ability_id):
+            self._abilities.remove(ability_id)
+            self.ability_mask &= ~(1 << self.catalog.bit_index(ability_id))
+            self.counters.remove(ability_id)
+            self.resources.remove(ability_id)
+            # Normally you would need to track the cost of the ability to refund properly
+            # This could be an enhancement: Add ability costs to the data structure
+        else:
+            raise ValueError(f"Ability {ability_id} not found.")
+
+    def set_name(self, name):
+        """Set the character's name."""
+        self.name = name
+
+    def set_race(self, race):
+        """Set the character's race."""
+        self.race = race
+
+    def choose_god(self, god_id):
+        """Choose a god for the character, allowing only one selection."""
+        if self.selected_god is None:
+            self.selected_god = god_id
+        else:
+            raise ValueError("A god has already been selected. You cannot choose more than one god.")
+
+    def reset_god(self):
+        """Reset the god selection (if you want to allow changing the god)."""
+        self.selected_god = None
+
+    def __repr__(self):
+        return f"Character(name={self.name}, race={self.race}, abilities={self.abilities}, remaining_ep={self.remaining_ep()}, selected_god={self.selected_god})"
+
+
+class CharacterSnapshot(PlanState):
+    """A character frozen as it was when the snapshot was taken, with the remaining EP and state key."""
+
+    def __init__(self, character):
+        super().__init__(character.catalog, character.abilities, character.selected_god, character.lp_max,
+                         character.counters.copy())
+        self.ep = character.remaining_ep()
+        self.key = character.state_key()
+
+    def remaining_ep(self):
+        return self.ep
+
+    def is_current(self, character):
+        """True if the character has not changed since the snapshot was taken."""
+        return character.state_key() == self.key
+
+
+# The free abilities handed out when a class menu is opened for the first time. Each flow takes the
+# character, the abilities of the class file and choose(ability_list, prompt_message), which picks
+# one of the options (the builder asks the player, CharacterBuilder takes them from a list), or returns
+# None if the player closed the dialog. They return the ids of the abilities granted, or [] if there
+# was nothing to grant or a choice was cancelled; a cancelled flow grants nothing.
+
+class NoFreeAbilities(Exception):
+    """A divine class has no free spells to offer for the chosen god."""
+
+
+def _already_granted(character, prefix, flag):
+    # Owning any ability of the class means the free abilities were handed out earlier
+    if any(prefix in ability_id for ability_id in character.abilities):
+        setattr(character, flag, True)
+    return getattr(character, flag)
+
+
+def free_alchemist_abilities(character, abilities, choose):
+    """Two free alchemist abilities: one from a specific list and one with grade 1 prerequisites."""
+    if _already_granted(character, "alkymi_", 'free_spells_granted_for_alchemist'):
+        return []
+
+    # 1. First ability: Choose between 'alkymi_bloedning' or 'alkymi_alkymisk_analyse'
+    alchemist_options = [
+        ability for ability in abilities
+        if ability['id'] in ['alkymi_bloedning', 'alkymi_alkymisk_analyse']
+    ]
+    first_ability = choose(alchemist_options, "Vælg en gratis alkymist evne")
+    if first_ability is None:
+        return []
+
+    # 2. Second ability: Choose from abilities with 'grade' in prerequisites, and 'grade' == 1
+    grade_1_abilities = [
+        ability for ability in abilities
+        if ability.get('prerequisite') and ability['prerequisite'].get('grade') == 1
+    ]
+    if grade_1_abilities:
+        second_ability = choose(grade_1_abilities, "Vælg en gratis evne med grad 1")
+        if second_ability is None:
+            return []
+        granted = [first_ability['id'], second_ability['id']]
+    else:
+        print("No abilities with grade 1 prerequisites found.")
+        granted = [first_ability['id']]
+
+    for ability_id in granted:
+        character.add_ability(ability_id, 0)
+    character.free_spells_granted_for_alchemist = True
+    return granted
+
+
+def _free_divine_spells(character, abilities, choose, spell_prefix, second_prompt):
+    """Two free first-level spells from the Almen school or the school of the chosen god."""
+    if character.selected_god is None:
+        return []
+
+    selected_god = character.selected_god.replace("god_", "")
+    free_spells = [
+        ability for ability in abilities
+        if spell_prefix in ability['id']
+        and (ability['school'] == 'almen' or ability['school'] == selected_god)
+        # Spells with no prerequisite are level 1 too
+        and (ability.get('prerequisite') is None or ability['prerequisite'].get('grade', 0) == 1)
+    ]
+    if not free_spells:
+        raise NoFreeAbilities("Der er ingen gratis besværgelser tilgængelige.")
+
+    chosen_spell_1 = choose(free_spells, "Vælg en gratis førstegradbesværgelse")
+    if chosen_spell_1 is None:
+        return []
+    free_spells.remove(chosen_spell_1)
+    chosen_spell_2 = choose(free_spells, second_prompt)
+    if chosen_spell_2 is None:
+        return []
+
+    granted = [chosen_spell_1['id'], chosen_spell_2['id']]
+    for ability_id in granted:
+        character.add_ability(ability_id, 0)
+    return granted
+
+
+def free_priest_abilities(character, abilities, choose):
+    """Two free first-level spells from the Priest's Almen or god school."""
+    if _already_granted(character, "priest_", 'free_spells_granted_for_priest'):
+        return []
+    granted = _free_divine_spells(character, abilities, choose, 'priest_spell',
+                                  "Vælg endnu en gratis førstegradbesværgelse")
+    if granted:
+        character.free_spells_granted_for_priest = True
+    return granted
+
+
+def free_paladin_abilities(character, abilities, choose):
+    """Two free first-level spells from the Paladin's Almen or god school."""
+    if _already_granted(character, "paladin_", 'free_spells_granted_for_paladin'):
+        return []
+    granted = _free_divine_spells(character, abilities, choose, 'paladin_spell',
+                                  "Vælg en anden gratis førstegradbesværgelse")
+    if granted:
+        character.free_spells_granted_for_paladin = True
+    return granted
+
+
+def free_warrior_abilities(character, abilities, choose):
+    """Three free warrior abilities: any the character qualifies for, one of the general
+    discipline, and one more of the discipline of the first."""
+    if _already_granted(character, "warrior_", 'free_spells_granted_for_warrior'):
+        return []
+
+    rule_state = RuleState(character)
+    warrior_abilities = [ability for ability in abilities if character.catalog.rules[ability['id']](rule_state)]
+    first_ability = choose(warrior_abilities, "Vælg en gratis førstegradskrigerevne")
+    if first_ability is None:
+        return []
+
+    general_discipline_abilities = [
+        ability for ability in abilities
+        if ability.get('grade') == 1 and ability.get('discipline') == "den_almen_disciplin"
+    ]
+    second_ability = choose(general_discipline_abilities, "Vælg en gratis almen disciplin evne")
+    if second_ability is None:
+        return []
+
+    discipline_of_first_ability = first_ability.get('discipline', None)
+    matching_discipline_abilities = [
+        ability for ability in abilities
+        if ability.get('grade') == 1 and ability.get('discipline') == discipline_of_first_ability
+        and ability['id'] != first_ability['id']  # Ensure the third ability isn't the same as the first one
+        and ability['id'] != second_ability['id']  # Ensure the third ability isn't the same as the second one
+    ]
+    third_ability = choose(matching_discipline_abilities, f"Vælg en gratis evne fra disciplinen {discipline_of_first_ability}")
+    if third_ability is None:
+        return []
+
+    granted = [first_ability['id'], second_ability['id'], third_ability['id']]
+    for ability_id in granted:
+        character.add_ability(ability_id, 0)
+    character.free_spells_granted_for_warrior = True
+    return granted
+
+
+def _free_spell_of_type(character, abilities, choose, spell_type, prompt):
+    """One free spell of a type that the character meets the prerequisites for.
+
+    None if there is none, or if the choice was cancelled.
+    """
+    rule_state = RuleState(character)
+    available_spells = [
+        ability for ability in abilities
+        if ability.get('type') == spell_type and character.catalog.rules[ability['id']](rule_state)
+    ]
+    if not available_spells:
+        print(f"No {spell_type.replace('_spell', '')} spells available that meet the prerequisites.")
+        return None
+    chosen_spell = choose(available_spells, prompt)
+    if chosen_spell is None:
+        return None
+    character.add_ability(chosen_spell['id'], 0)
+    return chosen_spell['id']
+
+
+def free_druid_abilities(character, abilities, choose):
+    """One free druid spell for which the character meets the prerequisites."""
+    if _already_granted(character, "druid_", 'free_spells_granted_for_druid'):
+        return []
+    chosen = _free_spell_of_type(character, abilities, choose, 'druid_spell', "Vælg en gratis druidebesværgelse")
+    if chosen is None:
+        return []
+    character.free_spells_granted_for_druid = True
+    return [chosen]
+
+
+def free_witch_abilities(character, abilities, choose):
+    """One free witch spell of grade 1."""
+    if _already_granted(character, "witch_", 'free_spells_granted_for_witch'):
+        return []
+
+    grade_1_spells = [
+        ability for ability in abilities
+        if ability.get('type') == 'witch_spell' and ability.get('grade') == 1
+    ]
+    if len(grade_1_spells) < 2:
+        print("Not enough grade 1 witch spells available.")
+        return []
+
+    first_spell = choose(grade_1_spells, "Vælg en gratis heksebesværgelse (grad 1)")
+    if first_spell is None:
+        return []
+    character.add_ability(first_spell['id'], 0)
+    character.free_spells_granted_for_witch = True
+    return [first_spell['id']]
+
+
+def free_runesmith_abilities(character, abilities, choose):
+    """One free runesmith spell the character meets the prerequisites for, and one first-level spell."""
+    if _already_granted(character, "runesmith_", 'free_spells_granted_for_runesmith'):
+        return []
+    chosen = _free_spell_of_type(character, abilities, choose, 'runesmith_spell',
+                                 "Vælg en gratis runesmed besværgelse")
+    if chosen is None:
+        return []
+    character.free_spells_granted_for_runesmith = True
+    granted = [chosen]
+
+    free_spells = [ability for ability in abilities
+                   if 'runesmith_spell' in ability['id']
+                   and ability.get('prerequisite') and ability['prerequisite'].get('grade') == 1]
+    if free_spells:
+        chosen_spell = choose(free_spells, "Vælg en første niveau runesmedefortryllelse")
+        if chosen_spell is None:
+            # The first spell was already handed out; take it back so the whole grant can be done again
+            character.remove_ability(chosen)
+            character.free_spells_granted_for_runesmith = False
+            return []
+        character.add_ability(chosen_spell['id'], 0)
+        granted.append(chosen_spell['id'])
+    return granted
+
+
+def free_wizard_abilities(character, abilities, choose):
+    """Three free wizard abilities: a first-level school, an Almen spell and a spell of that school."""
+    if _already_granted(character, "wizard_", 'free_spells_granted_for_wizard'):
+        return []
+
+    first_options = [
+        ability for ability in abilities
+        if ability['id'] in ["wizard_level_1_elementalisme", "wizard_level_1_mentalisme", "wizard_level_1_morticisme"]
+    ]
+    first_ability = choose(first_options, "Vælg en gratis første niveau troldmands evne")
+    if first_ability is None:
+        return []
+
+    second_options = [
+        ability for ability in abilities
+        if ability.get('type') == 'wizard_spell' and ability.get('school') == 'almen' and ability.get('grade') == 1
+    ]
+    if not second_options:
+        print("No valid second ability options available.")
+        return []
+    second_ability = choose(second_options, "Vælg en gratis almen besværgelse af første grad")
+    if second_ability is None:
+        return []
+
+    selected_school = first_ability.get('school', None)
+    third_options = [
+        ability for ability in abilities
+        if ability.get('type') == 'wizard_spell' and ability.get('school') == selected_school and ability.get('grade') == 1
+    ]
+    if not third_options:
+        print(f"No valid third ability options available for the school {selected_school}.")
+        return []
+    third_ability = choose(third_options, f"Vælg en gratis besværgelse fra skolen {selected_school}")
+    if third_ability is None:
+        return []
+
+    granted = [first_ability['id'], second_ability['id'], third_ability['id']]
+    for ability_id in granted:
+        character.add_ability(ability_id, 0)
+    character.free_spells_granted_for_wizard = True
+    return granted
+
+
+# Class file -> (flow for its free abilities, id prefix of the class, flag that records they were handed out)
+FREE_ABILITIES = {
+    "alkymi.json": (free_alchemist_abilities, "alkymi_", 'free_spells_granted_for_alchemist'),
+    "præst.json": (free_priest_abilities, "priest_", 'free_spells_granted_for_priest'),
+    "paladin.json": (free_paladin_abilities, "paladin_", 'free_spells_granted_for_paladin'),
+    "kriger.json": (free_warrior_abilities, "warrior_", 'free_spells_granted_for_warrior'),
+    "druide.json": (free_druid_abilities, "druid_", 'free_spells_granted_for_druid'),
+    "heks.json": (free_witch_abilities, "witch_", 'free_spells_granted_for_witch'),
+    "runesmed.json": (free_runesmith_abilities, "runesmith_", 'free_spells_granted_for_runesmith'),
+    "trolddom.json": (free_wizard_abilities, "wizard_", 'free_spells_granted_for_wizard'),
+}
+
+
+class CharacterBuilder:
+    """The rules of the character builder's menus, without any windows.
+
+    Abilities can only be bought from the standard menu and the class menus the character has
+    opened, and a class menu with free abilities has to have them handed out (grant_free) before
+    anything else is bought from it. Illegal steps raise ValueError.
+    """
+
+    def __init__(self, character=None, catalog=None):
+        self.catalog = catalog if catalog is not None else (character.catalog if character else get_catalog())
+        self.character = character if character is not None else Character(self.catalog)
+        self.gates = {os.path.basename(file): ability_id for ability_id, (_, file) in MENU_UNLOCKS.items()}
+
+    @classmethod
+    def load(cls, filename, catalog=None):
+        character = Character(catalog)
+        with open(filename, 'r', encoding='utf-8') as file:
+            character.load_from_data(json.load(file))
+        return cls(character)
+
+    def save(self, filename):
+        self.character.save_to_file(filename)
+
+    def menus(self):
+        """The ability files the character can buy from."""
+        return [STANDARD_FILE] + [file for ability_id, (_, file) in MENU_UNLOCKS.items()
+                                  if self.character.has_ability(ability_id)]
+
+    def free_abilities_pending(self, ability_file):
+        """Whether a class menu still has free abilities to hand out before anything can be bought from it."""
+        entry = FREE_ABILITIES.get(os.path.basename(ability_file))
+        return entry is not None and not _already_granted(self.character, *entry[1:])
+
+    def available(self, ability_file=None):
+        """The abilities that can be bought (or gods that can be chosen) right now, from one menu or all open ones."""
+        menus = self.menus()
+        available = {}
+        for file in [ability_file] if ability_file else menus:
+            if file not in menus:
+                continue
+            states = self.catalog.matrix(file).states(self.character)
+            for ability, state in zip(self.catalog.abilities(file), states):
+                if state != "available" or ability['id'] in available:
+                    continue
+                if ability.get('type') == 'god':
+                    available[ability['id']] = ability
+                elif ability['cost'] <= self.character.remaining_ep() and not self.free_abilities_pending(file):
+                    available[ability['id']] = ability
+        return list(available.values())
+
+    def purchase(self, ability_id):
+        """Buy an ability, or choose a god, as clicking it in its menu would."""
+        ability = self.catalog.get(ability_id)
+        if ability is None:
+            raise ValueError(f"Unknown ability: {ability_id}")
+        if ability.get('type') == 'god':
+            self.select_god(ability_id)
+            return
+
+        menu = self.catalog.source[ability_id]
+        if menu not in {os.path.basename(file) for file in self.menus()}:
+            raise ValueError(f"{ability_id} is in the menu {menu}, which the character has not opened")
+        if self.free_abilities_pending(menu):
+            raise ValueError(f"The free abilities of {menu} have to be chosen before buying {ability_id}")
+        if not self.catalog.rules[ability_id](RuleState(self.character)):
+            raise ValueError(f"The character does not meet the prerequisites of {ability_id}")
+        self.character.add_ability(ability_id, ability['cost'])
+
+    def select_god(self, god_id):
+        ability = self.catalog.get(god_id)
+        if ability is None or ability.get('type') != 'god':
+            raise ValueError(f"Unknown god: {god_id}")
+        if not any(self.character.has_ability(self.gates[name]) for name in ("præst.json", "paladin.json")):
+            raise ValueError("A god can only be chosen in the priest or paladin menu, which the character has not opened")
+        self.character.select_god(god_id)
+
+    def grant_free(self, ability_file, choices):
+        """Hand out the free abilities of a class menu, answering its questions with the ids in choices, in order.
+
+        Returns the ids granted ([] if the menu has none left to give).
+        """
+        name = os.path.basename(ability_file)
+        if name not in FREE_ABILITIES:
+            raise ValueError(f"{name} has no free abilities")
+        if not self.character.has_ability(self.gates[name]):
+            raise ValueError(f"The character has not opened the menu {name}")
+        pending = list(choices)
+
+        def choose(ability_list, prompt_message):
+            if not pending:
+                raise ValueError(f"No choice given for '{prompt_message}'")
+            chosen = pending.pop(0)
+            for ability in ability_list:
+                if ability['id'] == chosen:
+                    return ability
+            options = ", ".join(ability['id'] for ability in ability_list)
+            raise ValueError(f"{chosen} can't be chosen for '{prompt_message}' (options: {options})")
+
+        grant = FREE_ABILITIES[name][0]
+        try:
+            granted = grant(self.character, self.catalog.abilities(ability_file), choose)
+        except NoFreeAbilities:
+            return []
+        if pending:
+            raise ValueError(f"Choices left over after the free abilities of {name}: {' '.join(pending)}")
+        return granted
+
+
+def apply_choices(builder, choices):
+    """Apply a list of steps: ability or god ids to buy, and 'file.json:id,id,...' to hand out free abilities."""
+    for step in choices.split():
+        if ":" in step:
+            ability_file, picks = step.split(":", 1)
+            builder.grant_free(ability_file, [pick for pick in picks.split(",") if pick])
+        else:
+            builder.purchase(step)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Byg mange karakterer ud fra et regneark (.csv) med kolonnerne spiller, karakter, navn og valg.",
+        epilog="karakter er den karakterfil der bygges videre på, og navn er karakterens navn (tom: navnet fra "
+               "filen). valg er evne- og gude-id'er i den rækkefølge de købes, og 'kriger.json:id,id,id' for de "
+               "gratis evner i en klassemenu. Hver spiller gemmes som <ud>/<spiller>.json.")
+    parser.add_argument("regneark", help="CSV-fil med én række per spiller")
+    parser.add_argument("--ud", default="Mine karakterer", help="mappen karaktererne gemmes i (standard: Mine karakterer)")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.regneark, 'r', encoding='utf-8-sig', newline='') as file:
+            sample = file.read(4096)
+            file.seek(0)
+            options = {}
+            try:
+                # Spreadsheets in Danish locales export with semicolons
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                # Rows of different lengths throw the sniffer off; the header still shows the delimiter
+                header = sample.partition("\n")[0]
+                dialect, options = csv.excel, {'delimiter': max(",;\t", key=header.count)}
+            rows = list(csv.DictReader(file, dialect=dialect, **options))
+    except (OSError, csv.Error) as e:
+        print(f"{args.regneark}: {e}")
+        return 1
+
+    catalog = get_catalog()
+    os.makedirs(args.ud, exist_ok=True)
+    failed = 0
+    for line, row in enumerate(rows, start=2):
+        # Short rows have None for the missing cells, and a missing column is just empty
+        player = (row.get('spiller') or "").strip()
+        try:
+            if not player:
+                raise ValueError("no player in the spiller column")
+            # The player names the file, which has to stay in the output directory
+            if player.startswith(".") or os.path.basename(player) != player or "\\" in player:
+                raise ValueError(f"{player!r} can't be used as a file name")
+            character_file = (row.get('karakter') or "").strip()
+            if not character_file:
+                raise ValueError("no character file in the karakter column")
+            builder = CharacterBuilder.load(character_file, catalog)
+            name = (row.get('navn') or "").strip()
+            if name:
+                builder.character.set_name(name)
+            apply_choices(builder, row.get('valg') or "")
+            builder.save(os.path.join(args.ud, f"{player}.json"))
+        except (OSError, ValueError, KeyError, AttributeError, TypeError) as e:
+            failed += 1
+            print(f"Line {line} ({player}): {e}")
+    print(f"{len(rows) - failed} of {len(rows)} characters saved to {args.ud}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
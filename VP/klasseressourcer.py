@@ -0,0 +1,97 @@
+from collections import namedtuple
+from functools import lru_cache
+
+# A class resource is a base amount plus what each owned ability adds to it
+ClassResource = namedtuple('ClassResource', ['name', 'ability_file', 'base', 'contribution'])
+
+
+def _spell_grade(spell):
+    if spell and 'grade' in spell:
+        return spell['grade']
+    return 0
+
+
+def _hjerteslag(ability_id, spell):
+    if "druid_ability" in ability_id:
+        # The last character of the ID should be a number between 2 and 6
+        last_char = ability_id[-1]
+        if last_char.isdigit() and 2 <= int(last_char) <= 6:
+            return int(last_char)
+        return 0
+    if "druid_spell" in ability_id:
+        return _spell_grade(spell)
+    return 0
+
+
+def _mana(ability_id, spell):
+    if "wizard_spell" in ability_id:
+        # 3 mana per grade level
+        return _spell_grade(spell) * 3
+    if "wizard_ekstra_mana" in ability_id:
+        return 6
+    return 0
+
+
+def _gudetro(ability_id, spell):
+    if "priest_spell" in ability_id:
+        return _spell_grade(spell) * 3
+    return 0
+
+
+def _tro(ability_id, spell):
+    if "paladin_spell" in ability_id:
+        return _spell_grade(spell) * 3
+    return 0
+
+
+def _skyggeskaar(ability_id, spell):
+    if "witch_ability" in ability_id:
+        last_char = ability_id[-1]
+        return int(last_char) if last_char.isdigit() else 0
+    if "witch_spell" in ability_id:
+        return _spell_grade(spell)
+    return 0
+
+
+# Keyed by the class names VP_evner uses
+RESOURCES = {
+    "Druid": ClassResource("Hjerteslag", "Filer/druide.json", 2, _hjerteslag),
+    "Wizard": ClassResource("Mana", "Filer/trolddom.json", 0, _mana),
+    "Priest": ClassResource("Gudetro", "Filer/præst.json", 0, _gudetro),
+    "Paladin": ClassResource("Tro", "Filer/paladin.json", 0, _tro),
+    "Witch": ClassResource("Skyggeskår", "Filer/heks.json", 1, _skyggeskaar),
+}
+
+
+@lru_cache(maxsize=None)
+def ability_contributions(catalog, ability_id):
+    """What one ability adds to each class resource, as (class name, amount) pairs. Worked out once per id."""
+    contributions = []
+    for class_name, resource in RESOURCES.items():
+        spell = catalog.abilities(resource.ability_file).by_id.get(ability_id)
+        amount = resource.contribution(ability_id, spell)
+        if amount:
+            contributions.append((class_name, amount))
+    return tuple(contributions)
+
+
+class ResourceTotals:
+    """The class resources of one character, kept up to date as abilities are added and removed."""
+
+    def __init__(self, catalog, ability_ids=()):
+        self.catalog = catalog
+        self.totals = {class_name: resource.base for class_name, resource in RESOURCES.items()}
+        for ability_id in ability_ids:
+            self.add(ability_id)
+
+    def add(self, ability_id):
+        for class_name, amount in ability_contributions(self.catalog, ability_id):
+            self.totals[class_name] += amount
+
+    def remove(self, ability_id):
+        for class_name, amount in ability_contributions(self.catalog, ability_id):
+            self.totals[class_name] -= amount
+
+    def text(self, class_name):
+        """E.g. 'Mana: 12' for "Wizard"."""
+        return f"{RESOURCES[class_name].name}: {self.totals[class_name]}"
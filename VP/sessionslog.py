@@ -0,0 +1,54 @@
+import json
+import os
+import time
+
+# Opt in by naming a file, e.g. `VP_SESSIONSLOG=session.jsonl python VP_evner.py`. Every user action
+# is then written to that file as one JSON object per line, and genafspilning.py can replay it.
+ENVIRONMENT_VARIABLE = "VP_SESSIONSLOG"
+
+
+class SessionRecorder:
+    """Writes the user's actions in the character builder to a replayable log.
+
+    Each entry has an "action" ("load", "purchase", "choice", "open_menu" or "save"), the seconds
+    since recording started as "t", and the details needed to repeat it. Choosing a god is a
+    purchase in a divine menu, and the free ability choices follow the action that asked for them.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.start = None
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def open(self, filename):
+        self.file = open(filename, 'w', encoding='utf-8')
+        self.start = time.perf_counter()
+
+    def record(self, action, **details):
+        if self.file is None:
+            return
+        entry = {"action": action, "t": round(time.perf_counter() - self.start, 3), **details}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # Flush every entry, so the log is complete up to a freeze even if the program is killed
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+recorder = SessionRecorder()
+
+
+def read_session(filename):
+    """The entries of a recorded session, in order."""
+    with open(filename, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    recorder.open(os.environ[ENVIRONMENT_VARIABLE])
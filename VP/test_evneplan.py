@@ -0,0 +1,36 @@
+import json
+import os
+import unittest
+
+from evnekatalog import get_catalog
+from evneplan import Planner, main
+from evneregler import PlanState
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VESTLENER = os.path.join(HERE, "Nye karakterer", "Menneske_Vestlener.json")
+
+
+class PlannerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The catalog is read from Filer/ in the working directory
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(HERE)
+
+    def setUp(self):
+        self.catalog = get_catalog()
+        with open(VESTLENER, 'r', encoding='utf-8') as file:
+            self.state = PlanState.from_character_data(self.catalog, json.load(file))
+
+    def test_cheapest_plan(self):
+        plan = Planner(self.catalog).plan(self.state, 'warrior_ability_level_3_tactics')
+        self.assertEqual(plan.total_ep, 51)
+        self.assertEqual(plan.steps[-1], 'warrior_ability_level_3_tactics')
+        self.assertEqual(sum(self.catalog.by_id[ability_id]['cost'] for ability_id in plan.steps), 51)
+
+    def test_unknown_ability(self):
+        self.assertEqual(main([VESTLENER, 'ingen_evne']), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
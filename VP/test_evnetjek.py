@@ -0,0 +1,31 @@
+import os
+import unittest
+
+from evnekatalog import get_catalog
+from evneregler import NOT_OFFERED
+from evnetjek import lint, unreachable_abilities
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class LintTest(unittest.TestCase):
+    def setUp(self):
+        self.catalog = get_catalog(os.path.join(HERE, "Filer"))
+
+    def test_catalog_is_clean(self):
+        self.assertEqual(lint(self.catalog), [])
+
+    def test_menu_that_never_opens(self):
+        # The catalog is shared, so the prerequisite is put back afterwards
+        self.addCleanup(self.catalog.prerequisites.__setitem__, 'ability_runesmedning',
+                        self.catalog.prerequisites['ability_runesmedning'])
+        self.catalog.prerequisites['ability_runesmedning'] = NOT_OFFERED
+        unreachable = unreachable_abilities(self.catalog)
+        self.assertIn('ability_runesmedning', unreachable)
+        self.assertTrue(all(self.catalog.source[ability_id] == "runesmed.json"
+                            for ability_id in unreachable if ability_id != 'ability_runesmedning'))
+        self.assertIn("runesmed.json", {self.catalog.source[ability_id] for ability_id in unreachable})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+
+from evnekatalog import get_catalog
+from karakterbygger import Character, free_wizard_abilities, main
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VESTLENER = os.path.join(HERE, "Nye karakterer", "Menneske_Vestlener.json")
+
+
+class SpreadsheetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The catalog is read from Filer/ in the working directory
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(HERE)
+
+    def build(self, rows, header="spiller;karakter;navn;valg"):
+        with tempfile.TemporaryDirectory() as folder:
+            sheet = os.path.join(folder, "hold.csv")
+            with open(sheet, 'w', encoding='utf-8') as file:
+                file.write(f"{header}\n")
+                file.writelines(f"{row}\n" for row in rows)
+            out = os.path.join(folder, "ud")
+            status = main([sheet, "--ud", out])
+            saved = {}
+            for name in os.listdir(out):
+                with open(os.path.join(out, name), 'r', encoding='utf-8') as file:
+                    saved[name] = json.load(file)
+            return status, saved
+
+    def test_character_name_column(self):
+        status, saved = self.build([f"Mette;{VESTLENER};Ragnar Jernhånd;ability_skjoldbrug"])
+        self.assertEqual(status, 0)
+        self.assertEqual(saved["Mette.json"]['name'], "Ragnar Jernhånd")
+        self.assertIn('ability_skjoldbrug', saved["Mette.json"]['abilities'])
+
+    def test_blank_name_keeps_the_template_name(self):
+        with open(VESTLENER, 'r', encoding='utf-8') as file:
+            template_name = json.load(file).get('name', "")
+        status, saved = self.build([f"Mette;{VESTLENER};;"])
+        self.assertEqual(status, 0)
+        self.assertEqual(saved["Mette.json"]['name'], template_name)
+
+    def test_bad_rows_are_skipped(self):
+        status, saved = self.build([f"../Ude;{VESTLENER};;", "Kort", f"Mette;{VESTLENER};Ragnar;"])
+        self.assertEqual(status, 1)
+        self.assertEqual(list(saved), ["Mette.json"])
+
+    def test_missing_player_column(self):
+        status, saved = self.build([f"{VESTLENER};Ragnar;"], header="karakter;navn;valg")
+        self.assertEqual(status, 1)
+        self.assertEqual(saved, {})
+
+
+class CharacterTest(unittest.TestCase):
+    def test_duplicate_abilities_are_owned_once(self):
+        character = Character(get_catalog(os.path.join(HERE, "Filer")))
+        character.load_from_data({'abilities': ['ability_skjoldbrug', 'ability_kamptraening', 'ability_skjoldbrug']})
+        self.assertEqual(character.abilities, ['ability_skjoldbrug', 'ability_kamptraening'])
+        character.remove_ability('ability_skjoldbrug')
+        self.assertFalse(character.has_ability('ability_skjoldbrug'))
+        self.assertNotIn('ability_skjoldbrug', character.abilities)
+
+
+class CancelledChoiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The catalog is read from Filer/ in the working directory
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(HERE)
+
+    def setUp(self):
+        self.catalog = get_catalog()
+        self.character = Character(self.catalog)
+        self.character.load_from_file(VESTLENER)
+        self.before = self.character.to_data()
+
+    def test_cancelled_last_wizard_choice(self):
+        answers = [0, 0, None]  # The player closes the third dialog
+
+        def choose(ability_list, prompt_message):
+            answer = answers.pop(0)
+            return None if answer is None else ability_list[answer]
+        self.assertEqual(free_wizard_abilities(self.character, self.catalog.abilities("trolddom.json"), choose), [])
+        self.assertEqual(answers, [])
+        self.assertEqual(self.character.to_data(), self.before)
+        self.assertFalse(self.character.free_spells_granted_for_wizard)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import unittest
+from http import HTTPStatus
+
+from evnekatalog import get_catalog
+import tjeneste
+from tjeneste import CharacterService, Request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VESTLENER = os.path.join(HERE, "Nye karakterer", "Menneske_Vestlener.json")
+
+
+class ServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The catalog is read from Filer/ in the working directory
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(HERE)
+
+    def setUp(self):
+        self.service = CharacterService(get_catalog(), HERE)
+
+    def call(self, method, path, body=None):
+        request = Request(method, path, {}, json.dumps(body).encode('utf-8') if body is not None else b"")
+        status, _, data = asyncio.run(self.service.dispatch(request))
+        return status, json.loads(data)
+
+    def test_character_of_the_wrong_type(self):
+        status, data = self.call("POST", "/karakterer", {"karakter": "abc"})
+        self.assertEqual(status, HTTPStatus.BAD_REQUEST)
+        self.assertIn("karakter", data['error'])
+
+    def test_ability_of_the_wrong_type(self):
+        with open(VESTLENER, 'r', encoding='utf-8') as file:
+            status, created = self.call("POST", "/karakterer", {"karakter": json.load(file)})
+        self.assertEqual(status, HTTPStatus.CREATED)
+        status, data = self.call("POST", f"/karakterer/{created['id']}/koeb", {"evne": ["x"]})
+        self.assertEqual(status, HTTPStatus.BAD_REQUEST)
+        self.assertIn("evne", data['error'])
+
+    def test_character_fields_of_the_wrong_type(self):
+        for character in ({"total_ep": "x"}, {"abilities": [1, 2]}, {"selected_god": 3}):
+            status, data = self.call("POST", "/karakterer", {"karakter": character})
+            self.assertEqual(status, HTTPStatus.BAD_REQUEST, character)
+        self.assertEqual(self.call("GET", "/karakterer"), (HTTPStatus.OK, []))
+
+    def create(self):
+        with open(VESTLENER, 'r', encoding='utf-8') as file:
+            return self.call("POST", "/karakterer", {"karakter": json.load(file)})[1]['id']
+
+    def test_closing_twice_at_once(self):
+        session_id = self.create()
+
+        async def close_twice():
+            request = Request("DELETE", f"/karakterer/{session_id}", {}, b"")
+            return await asyncio.gather(self.service.dispatch(request), self.service.dispatch(request))
+
+        statuses = sorted(status for status, _, _ in asyncio.run(close_twice()))
+        self.assertEqual(statuses, [HTTPStatus.OK, HTTPStatus.NOT_FOUND])
+
+    def test_idle_sessions_are_closed(self):
+        session_id = self.create()
+        self.service.sessions[session_id].used -= tjeneste.SESSION_TIMEOUT + 1
+        self.assertEqual(self.call("GET", "/karakterer"), (HTTPStatus.OK, []))
+        self.assertEqual(self.call("GET", f"/karakterer/{session_id}")[0], HTTPStatus.NOT_FOUND)
+
+    def test_unexpected_error(self):
+        def broken(session_id):
+            raise KeyError(session_id)
+        self.service.session = broken
+        with self.assertLogs('tjeneste', 'ERROR'):
+            status, data = self.call("GET", "/karakterer/abc")
+        self.assertEqual(status, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(data, {"error": "Internal error"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import atexit
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Opt in by naming a file, e.g. `VP_TIDSMAALING=tider.json python VP_evner.py`. The counts and times
+# are then recorded while the program runs and written to that file when it exits.
+ENVIRONMENT_VARIABLE = "VP_TIDSMAALING"
+
+
+class Stats:
+    """Call counts and wall time per named hot path.
+
+    Times are inclusive: a purchase that refreshes the menu counts the refresh under both names.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.entries = {}  # name -> [calls, total seconds, slowest call in seconds]
+
+    def record(self, name, seconds):
+        entry = self.entries.get(name)
+        if entry is None:
+            self.entries[name] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def report(self):
+        """Name -> calls and times in milliseconds, the names that took the most time in total first."""
+        ordered = sorted(self.entries.items(), key=lambda item: item[1][1], reverse=True)
+        return {name: {"calls": calls, "total_ms": total * 1000, "mean_ms": total * 1000 / calls,
+                       "max_ms": slowest * 1000}
+                for name, (calls, total, slowest) in ordered}
+
+    def dump(self, filename):
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=4, ensure_ascii=False)
+
+    def reset(self):
+        self.entries.clear()
+
+
+stats = Stats()
+
+
+def enable(dump_file=None):
+    """Start recording; if dump_file is given, the stats are written to it when the program exits."""
+    stats.enabled = True
+    if dump_file:
+        atexit.register(stats.dump, dump_file)
+
+
+@contextmanager
+def timed(name):
+    """Record the time spent in a with-block under a name."""
+    if not stats.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.record(name, time.perf_counter() - start)
+
+
+def timed_function(name):
+    """Decorator that records every call of a function under a name."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    enable(os.environ[ENVIRONMENT_VARIABLE])
@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from evnekatalog import get_catalog
+from karakterbygger import Character, CharacterBuilder
+
+MAX_BODY = 1024 * 1024  # Character files are a few KiB
+KEEP_ALIVE_TIMEOUT = 30  # Seconds an idle connection is kept open
+SESSION_TIMEOUT = 4 * 60 * 60  # Seconds an untouched character session is kept
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'body'])
+
+log = logging.getLogger(__name__)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    """One character being built. Requests for the same character are handled one at a time."""
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.lock = asyncio.Lock()
+        self.used = time.monotonic()
+
+
+def _json_body(request):
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The request body is not valid JSON")
+    if not isinstance(body, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object")
+    return body
+
+
+def _field(body, name, kind=str):
+    """The field of a JSON body, which has to be of type kind (a list is a list of strings)."""
+    if name not in body:
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Missing field: {name}")
+    value = body[name]
+    if not isinstance(value, kind) or (kind is list and not all(isinstance(item, str) for item in value)):
+        expected = {str: "a string", dict: "an object", list: "a list of strings"}[kind]
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Field {name} must be {expected}")
+    return value
+
+
+# The fields of a character file, with the types they may have
+CHARACTER_FIELDS = {'name': (str,), 'race': (str,), 'abilities': (list,), 'lp_max': (int,), 'spent_ep': (int,),
+                    'total_ep': (int,), 'selected_god': (str, type(None))}
+
+
+def _character_data(data, name):
+    """Character data from a request, checked before the builder gets it."""
+    if not isinstance(data, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be a JSON object")
+    for field, kinds in CHARACTER_FIELDS.items():
+        value = data.get(field)
+        if field in data and (not isinstance(value, kinds) or isinstance(value, bool)):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Field {field} of {name} has the wrong type")
+    if not all(isinstance(ability_id, str) for ability_id in data.get('abilities', ())):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Field abilities of {name} must be a list of strings")
+    return data
+
+
+class CharacterService:
+    """A small HTTP/JSON service for building characters from several machines at once.
+
+    Every session shares the one in-memory catalog. The rules are quick to check, so they run on
+    the event loop itself, under the lock of the character; character sheets take longer and are
+    rendered in a pool of processes so they don't hold up other requests. Sessions nobody has used
+    for SESSION_TIMEOUT are closed.
+
+    GET    /evner                           the ability files and how many abilities each has
+    GET    /evner?fil=Filer/kriger.json     the abilities of one file
+    GET    /evner/<id>                      one ability
+    GET    /karakterer                      the open sessions
+    POST   /karakterer                      {"fil": ...} or {"karakter": {...}}, optionally "navn"
+    GET    /karakterer/<id>                 the character
+    DELETE /karakterer/<id>                 close the session
+    GET    /karakterer/<id>/tilgaengelige   what can be bought now; ?menu=Filer/kriger.json for one menu
+    POST   /karakterer/<id>/koeb            {"evne": id} buys an ability or chooses a god
+    POST   /karakterer/<id>/gratis          {"menu": "kriger.json", "valg": [id, ...]} hands out free abilities
+    POST   /karakterer/<id>/gem             {"fil": "navn.json"} saves the character in the output directory
+    GET    /karakterer/<id>/karakterark.pdf the character sheet
+    """
+
+    def __init__(self, catalog, output_dir, pool=None):
+        self.catalog = catalog
+        self.output_dir = output_dir
+        self.pool = pool
+        self.sessions = {}  # session id -> Session
+        self.routes = [
+            ("GET", r"/evner", self.list_abilities),
+            ("GET", r"/evner/(?P<ability_id>[^/]+)", self.get_ability),
+            ("GET", r"/karakterer", self.list_sessions),
+            ("POST", r"/karakterer", self.create_session),
+            ("GET", r"/karakterer/(?P<session_id>\w+)", self.get_character),
+            ("DELETE", r"/karakterer/(?P<session_id>\w+)", self.close_session),
+            ("GET", r"/karakterer/(?P<session_id>\w+)/tilgaengelige", self.available),
+            ("POST", r"/karakterer/(?P<session_id>\w+)/koeb", self.purchase),
+            ("POST", r"/karakterer/(?P<session_id>\w+)/gratis", self.grant_free),
+            ("POST", r"/karakterer/(?P<session_id>\w+)/gem", self.save),
+            ("GET", r"/karakterer/(?P<session_id>\w+)/karakterark.pdf", self.character_sheet),
+        ]
+
+    # Catalog
+
+    async def list_abilities(self, request):
+        files = request.query.get('fil')
+        if not files:
+            return {name: len(abilities) for name, abilities in self.catalog.files.items()}
+        if os.path.basename(files[0]) not in self.catalog.files:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Unknown ability file: {files[0]}")
+        return [self._summary(ability) for ability in self.catalog.abilities(files[0])]
+
+    async def get_ability(self, request, ability_id):
+        ability = self.catalog.get(ability_id)
+        if ability is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Unknown ability: {ability_id}")
+        return dict(ability, file=self.catalog.source[ability_id])
+
+    @staticmethod
+    def _summary(ability):
+        return {"id": ability['id'], "name": ability['name'], "cost": ability.get('cost', 0), "type": ability.get('type')}
+
+    # Sessions
+
+    def session(self, session_id):
+        self._evict()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"No character session {session_id}")
+        session.used = time.monotonic()
+        return session
+
+    def _evict(self):
+        """Close the sessions nobody has touched for SESSION_TIMEOUT, so their builders don't pile up."""
+        oldest = time.monotonic() - SESSION_TIMEOUT
+        for session_id in [session_id for session_id, session in self.sessions.items()
+                           if session.used < oldest and not session.lock.locked()]:
+            del self.sessions[session_id]
+
+    def _describe(self, session_id, builder):
+        return {"id": session_id, "character": builder.character.to_data(),
+                "remaining_ep": builder.character.remaining_ep(), "menus": builder.menus()}
+
+    async def list_sessions(self, request):
+        self._evict()
+        return [{"id": session_id, "name": session.builder.character.name}
+                for session_id, session in self.sessions.items()]
+
+    async def create_session(self, request):
+        body = _json_body(request)
+        if 'karakter' in body:
+            character = Character(self.catalog)
+            character.load_from_data(_character_data(_field(body, 'karakter', dict), 'karakter'))
+        else:
+            path = _field(body, 'fil')
+            # Only character files below the directory the service was started in
+            full_path = os.path.realpath(path)
+            if os.path.commonpath([full_path, os.getcwd()]) != os.getcwd():
+                raise HttpError(HTTPStatus.FORBIDDEN, f"{path} is outside the service directory")
+            try:
+                with open(full_path, 'r', encoding='utf-8') as file:
+                    character = Character(self.catalog)
+                    character.load_from_data(_character_data(json.load(file), path))
+            except FileNotFoundError:
+                raise HttpError(HTTPStatus.NOT_FOUND, f"No character file {path}")
+        if 'navn' in body:
+            character.set_name(_field(body, 'navn'))
+
+        self._evict()
+        session_id = uuid.uuid4().hex[:12]
+        builder = CharacterBuilder(character, self.catalog)
+        # Only kept once the character could be described, so a broken one never lingers as a session
+        description = self._describe(session_id, builder)
+        self.sessions[session_id] = Session(builder)
+        return HTTPStatus.CREATED, description
+
+    async def get_character(self, request, session_id):
+        session = self.session(session_id)
+        async with session.lock:
+            return self._describe(session_id, session.builder)
+
+    async def close_session(self, request, session_id):
+        session = self.session(session_id)
+        async with session.lock:
+            # Another request may have closed it while this one waited for the lock
+            if self.sessions.pop(session_id, None) is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, f"No character session {session_id}")
+        return {"id": session_id}
+
+    # Building
+
+    async def available(self, request, session_id):
+        session = self.session(session_id)
+        menu = request.query.get('menu', [None])[0]
+        async with session.lock:
+            return [self._summary(ability) for ability in session.builder.available(menu)]
+
+    async def purchase(self, request, session_id):
+        session = self.session(session_id)
+        ability_id = _field(_json_body(request), 'evne')
+        async with session.lock:
+            session.builder.purchase(ability_id)
+            return self._describe(session_id, session.builder)
+
+    async def grant_free(self, request, session_id):
+        session = self.session(session_id)
+        body = _json_body(request)
+        menu, choices = _field(body, 'menu'), _field(body, 'valg', list)
+        async with session.lock:
+            granted = session.builder.grant_free(menu, choices)
+            return dict(self._describe(session_id, session.builder), granted=granted)
+
+    async def save(self, request, session_id):
+        session = self.session(session_id)
+        filename = os.path.basename(_field(_json_body(request), 'fil'))
+        if not filename.endswith(".json"):
+            filename += ".json"
+        path = os.path.join(self.output_dir, filename)
+        async with session.lock:
+            session.builder.save(path)
+        return {"file": path}
+
+    async def character_sheet(self, request, session_id):
+        session = self.session(session_id)
+        async with session.lock:
+            character_data = dict(session.builder.character.to_data())
+            character_data['abilities'] = list(character_data['abilities'])
+        # Imported here so the service runs without reportlab; only the sheets need it
+        import karakterark
+        loop = asyncio.get_running_loop()
+        pdf = await loop.run_in_executor(self.pool, karakterark.render_character_sheet, character_data)
+        return HTTPStatus.OK, "application/pdf", pdf
+
+    # HTTP
+
+    async def dispatch(self, request):
+        """(status, content type, body) for a request."""
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            try:
+                result = await handler(request, **{name: unquote(value) for name, value in match.groupdict().items()})
+            except HttpError as error:
+                return self._json(error.status, {"error": str(error)})
+            except ValueError as error:
+                # The builder's rules say no: not enough EP, missing prerequisites and so on
+                return self._json(HTTPStatus.UNPROCESSABLE_ENTITY, {"error": str(error)})
+            except ImportError as error:
+                return self._json(HTTPStatus.NOT_IMPLEMENTED, {"error": str(error)})
+            except Exception:
+                # A bug, not a bad request; the connection and the other sessions carry on
+                log.exception("%s %s failed", request.method, request.path)
+                return self._json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error"})
+            if isinstance(result, tuple) and len(result) == 3:
+                return result
+            if isinstance(result, tuple):
+                return self._json(*result)
+            return self._json(HTTPStatus.OK, result)
+        if allowed:
+            return self._json(HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{request.method} is not allowed on {request.path}"})
+        return self._json(HTTPStatus.NOT_FOUND, {"error": f"Nothing at {request.path}"})
+
+    @staticmethod
+    def _json(status, data):
+        return status, "application/json; charset=utf-8", json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    async def handle_connection(self, reader, writer):
+        """Serve the requests of one connection, keeping it open between them as HTTP/1.1 clients expect."""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._respond(writer, *self._json(HTTPStatus.BAD_REQUEST, {"error": "Malformed request"}),
+                                        keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, *self._json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                                            {"error": "Request body too large"}), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                url = urlsplit(target)
+                request = Request(method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), body)
+                keep_alive = version == "HTTP/1.1" and headers.get('connection', "").lower() != "close"
+                await self._respond(writer, *await self.dispatch(request), keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, content_type, body, keep_alive):
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host, port, output_dir, workers=None):
+    catalog = get_catalog()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        service = CharacterService(catalog, output_dir, pool)
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        for sock in server.sockets:
+            print(f"Serving characters on http://{sock.getsockname()[0]}:{sock.getsockname()[1]}/")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start karakterbyggeren som en HTTP/JSON-tjeneste på det lokale net.")
+    parser.add_argument("--vaert", default="0.0.0.0", help="adressen der lyttes på (standard: 0.0.0.0, alle)")
+    parser.add_argument("--port", type=int, default=8080, help="porten der lyttes på (standard: 8080)")
+    parser.add_argument("--ud", default="Mine karakterer", help="mappen karaktererne gemmes i (standard: Mine karakterer)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="antal processer til karakterark (standard: én pr. kerne)")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.ud, exist_ok=True)
+    try:
+        asyncio.run(serve(args.vaert, args.port, args.ud, args.jobs))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())